@@ -0,0 +1,65 @@
+import os
+import threading
+
+from PySide6 import QtCore
+
+import render
+import render_scheduler
+
+class BatchProcessor(QtCore.QObject):
+  # Progress message to display.
+  progress = QtCore.Signal(str)
+
+  finished = QtCore.Signal()
+
+  def __init__(self):
+    super().__init__()
+    # This is an event instead of a slot because the batch processor thread is busy rendering, and won't
+    # get to queued signals until it's done.
+    self._stop_requested = threading.Event()
+
+  def request_stop(self):
+    self._stop_requested.set()
+
+  @QtCore.Slot()
+  def request_process_files(self, paths, output_dir, configs):
+    self._stop_requested.clear()
+    jobs = [render_scheduler.RenderJob(input_path=path, output_path=render.output_path_for(path, output_dir))
+            for path in paths]
+    num_workers = render_scheduler.default_num_workers(len(jobs))
+
+    # Latest progress text for each file that's currently rendering.
+    active = {}
+    num_finished = 0
+
+    def update_progress():
+      text = f'[{num_finished}/{len(paths)}]'
+      if active:
+        text += ' ' + ', '.join(active.values())
+      self.progress.emit(text)
+
+    def job_progress(input_path, frames_done, num_frames, fps):
+      active[input_path] = f'{os.path.basename(input_path)}: {frames_done}/{num_frames} ({fps:.1f} FPS)'
+      update_progress()
+
+    def job_done(result):
+      nonlocal num_finished
+      num_finished += 1
+      active.pop(result.input_path, None)
+      if result.error is not None:
+        print(f'{result.input_path}: {result.error}')
+      update_progress()
+
+    self.progress.emit(f'Starting {len(paths)} file(s) with {num_workers} worker(s)')
+    results = render_scheduler.render_files(jobs, configs, num_workers=num_workers, progress_callback=job_progress,
+                                            done_callback=job_done, stop_event=self._stop_requested)
+
+    num_done = len([result for result in results if result.completed])
+    errors = [os.path.basename(result.input_path) for result in results if result.error is not None]
+    message = f'Processed {num_done}/{len(paths)} file(s)'
+    if self._stop_requested.is_set():
+      message += ' (Cancelled)'
+    if errors:
+      message += f', failed: {", ".join(errors)}'
+    self.progress.emit(message)
+    self.finished.emit()
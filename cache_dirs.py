@@ -0,0 +1,81 @@
+import hashlib
+import json
+import os
+import sys
+import tempfile
+from typing import Any, Callable
+
+import numpy as np
+
+# We hash this much from the start and the end of a file (plus the size) to identify it, which is enough to tell
+# videos apart without reading multi-GB files.
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+# Returns (and creates if necessary) a per-user cache directory for ReefShader, optionally with subdirectories.
+def cache_dir(*subdirs: str) -> str:
+  if sys.platform == 'win32':
+    base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+  elif sys.platform == 'darwin':
+    base = os.path.join(os.path.expanduser('~'), 'Library', 'Caches')
+  else:
+    base = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+  path = os.path.join(base, 'ReefShader', *subdirs)
+  os.makedirs(path, exist_ok=True)
+  return path
+
+# Hash that identifies a file's content, for keying sidecar files in the cache.
+def file_hash(path: str) -> str:
+  size = os.path.getsize(path)
+  h = hashlib.sha256()
+  h.update(f'{size}'.encode())
+  with open(path, 'rb') as f:
+    h.update(f.read(_HASH_CHUNK_SIZE))
+    f.seek(max(0, size - _HASH_CHUNK_SIZE))
+    h.update(f.read(_HASH_CHUNK_SIZE))
+  return h.hexdigest()
+
+# Path of a sidecar file for path in cache_dir(kind). Callers bump version whenever what they store changes, so files
+# from older versions are never loaded. key tells apart sidecars of the same file made with different settings.
+def sidecar_path(kind: str, path: str, version: int, extension: str, key: str | None = None) -> str:
+  name = f'{file_hash(path)}_v{version}' + (f'_{key}' if key is not None else '')
+  return os.path.join(cache_dir(kind), f'{name}.{extension}')
+
+# Writes through a temporary file in the same directory and renames it into place, so readers (including other
+# threads and processes writing the same file) never see a partial file.
+def _write_atomic(path: str, write: Callable[[Any], None], mode: str) -> None:
+  fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+  try:
+    with os.fdopen(fd, mode) as f:
+      write(f)
+    os.replace(tmp_path, path)
+  finally:
+    if os.path.exists(tmp_path):
+      os.remove(tmp_path)
+
+def save_npz_atomic(path: str, **arrays: np.ndarray) -> None:
+  _write_atomic(path, lambda f: np.savez(f, **arrays), 'wb')
+
+# Returns the arrays in an npz file, or None if it doesn't exist or can't be read.
+def load_npz(path: str) -> dict[str, np.ndarray] | None:
+  if not os.path.exists(path):
+    return None
+  try:
+    with np.load(path) as data:
+      return {name: data[name] for name in data.files}
+  except Exception as e:
+    print(f'Failed to load {path}: {e}')
+    return None
+
+def save_json_atomic(path: str, value: Any) -> None:
+  _write_atomic(path, lambda f: json.dump(value, f, indent=2), 'w')
+
+# Returns the value in a JSON file, or None if it doesn't exist or can't be read.
+def load_json(path: str) -> Any | None:
+  if not os.path.exists(path):
+    return None
+  try:
+    with open(path) as f:
+      return json.load(f)
+  except Exception as e:
+    print(f'Failed to load {path}: {e}')
+    return None
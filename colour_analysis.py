@@ -0,0 +1,108 @@
+# Analysis pass for colour normalisation. We stream the clip at the render size and record the per-frame channel
+# min/max, and cache them in a sidecar file keyed by a hash of the video file and the render width. The statistics
+# are taken with the same box filter as single pass normalisation, which only gives the same result at the same size
+# (the filter window is in pixels), so exports look like the preview the user graded with. At render time, the statistics are
+# smoothed forwards and backwards (so the smoothing doesn't lag behind the video), and used instead of computing
+# statistics at full resolution.
+#
+# We store the raw statistics rather than the smoothed ones, so changing the temporal smoothing doesn't require
+# analysing again.
+
+import dataclasses
+from typing import Callable
+
+import jax
+from jax import numpy as jnp
+import numpy as np
+
+import cache_dirs
+from config_dict import ConfigDict
+import decoding
+import process
+
+_STATS_VERSION = 2
+
+@dataclasses.dataclass
+class ColourStats:
+  # (N,) frame times in seconds, increasing.
+  frame_times: np.ndarray
+
+  # (N, C) per-frame channel min/max.
+  mins: np.ndarray
+  maxs: np.ndarray
+
+  # Returns the statistics smoothed forwards and backwards with an exponential moving average.
+  def smoothed(self, temporal_smoothing: float) -> 'ColourStats':
+    return ColourStats(
+      frame_times=self.frame_times,
+      mins=_smooth_forward_backward(self.mins, temporal_smoothing),
+      maxs=_smooth_forward_backward(self.maxs, temporal_smoothing))
+
+  # Returns (mins, maxs) for the frame closest to frame_time.
+  def lookup(self, frame_time: float) -> tuple[np.ndarray, np.ndarray]:
+    idx = int(np.searchsorted(self.frame_times, frame_time))
+    idx = min(max(idx, 0), len(self.frame_times) - 1)
+    if idx > 0 and abs(self.frame_times[idx - 1] - frame_time) < abs(self.frame_times[idx] - frame_time):
+      idx -= 1
+    return self.mins[idx], self.maxs[idx]
+
+def _smooth_forward_backward(values: np.ndarray, temporal_smoothing: float) -> np.ndarray:
+  ret = values.astype(np.float32).copy()
+  for i in range(1, len(ret)):
+    ret[i] = temporal_smoothing * ret[i - 1] + (1.0 - temporal_smoothing) * ret[i]
+  for i in range(len(ret) - 2, -1, -1):
+    ret[i] = temporal_smoothing * ret[i + 1] + (1.0 - temporal_smoothing) * ret[i]
+  return ret
+
+def stats_path(path: str, config: ConfigDict) -> str:
+  # Files narrower than the scaling width are rendered at their native width, which this also identifies.
+  width = str(int(config['scaling']['width'])) if config['scaling']['enabled'] else 'native'
+  return cache_dirs.sidecar_path('colour_stats', path, _STATS_VERSION, 'npz', key=width)
+
+@jax.jit
+def _frame_stats(frame: jnp.ndarray) -> tuple[jnp.ndarray, jnp.ndarray]:
+  return process.channel_min_max(frame)
+
+# Returns None if stopped through should_stop.
+def analyze(path: str, config: ConfigDict, should_stop: Callable[[], bool] | None = None) -> ColourStats | None:
+  reader, _ = decoding.open_video_reader(path)
+  # Same size as render.render_file decodes at.
+  size = process.scaled_size(reader.width(), reader.height(), config)
+  if size is not None:
+    reader.set_width(size[0])
+    reader.set_height(size[1])
+
+  frame_times = []
+  stats = []
+  while True:
+    if should_stop is not None and should_stop():
+      return None
+    try:
+      frame = next(reader)
+    except StopIteration:
+      break
+    frame_times.append(frame.frame_time)
+    # These stay on device until the end, so we don't sync every frame.
+    stats.append(_frame_stats(frame.data))
+
+  if not stats:
+    return ColourStats(frame_times=np.zeros((0,)), mins=np.zeros((0, 3)), maxs=np.zeros((0, 3)))
+
+  stats = jax.device_get(stats)
+  return ColourStats(
+    frame_times=np.array(frame_times, dtype=np.float64),
+    mins=np.stack([frame_mins for frame_mins, _ in stats]),
+    maxs=np.stack([frame_maxs for _, frame_maxs in stats]))
+
+# Loads statistics from the sidecar cache, or analyses the file (and caches the result) if we haven't seen it before.
+def load_or_analyze(path: str, config: ConfigDict,
+                    should_stop: Callable[[], bool] | None = None) -> ColourStats | None:
+  sidecar_path = stats_path(path, config)
+  data = cache_dirs.load_npz(sidecar_path)
+  if data is not None:
+    return ColourStats(frame_times=data['frame_times'], mins=data['mins'], maxs=data['maxs'])
+
+  stats = analyze(path, config, should_stop=should_stop)
+  if stats is not None and len(stats.frame_times) > 0:
+    cache_dirs.save_npz_atomic(sidecar_path, frame_times=stats.frame_times, mins=stats.mins, maxs=stats.maxs)
+  return stats
@@ -0,0 +1,59 @@
+# This is basically a dictionary wrapper that keeps track of which fields have been used, to help debug.
+class ConfigDict(dict):
+  def __init__(self):
+    super().__init__()
+    self._used_fields = set()
+
+  def __getitem__(self, key):
+    self._used_fields.add(key)
+    return super().__getitem__(key)
+
+  def unused_fields(self) -> set[str]:
+    return set(super().keys()) - self._used_fields
+
+  def unused_fields_recursive(self, prefix='') -> list[str]:
+    ret = []
+    unused = self.unused_fields()
+    for key in self.keys():
+      val = super().__getitem__(key)
+      if isinstance(val, ConfigDict):
+        ret.extend(val.unused_fields_recursive(prefix=f'{key}/'))
+      elif key in unused:
+        ret.append(f'{prefix}{key}')
+    return ret
+
+  def reset_usage_tracker(self):
+    self._used_fields = set()
+
+  def save_to_settings(self, settings, group=None):
+    if group is not None:
+      settings.beginGroup(group)
+
+    for k, v in self.items():
+      if isinstance(v, ConfigDict):
+        v.save_to_settings(settings, group=k)
+      else:
+        settings.setValue(k, v)
+
+    if group is not None:
+      settings.endGroup()
+
+  # Builds a ConfigDict from a nested dictionary (eg. loaded from JSON) with the same block/key structure.
+  @classmethod
+  def from_dict(cls, d: dict) -> 'ConfigDict':
+    ret = cls()
+    for k, v in d.items():
+      if isinstance(v, dict):
+        ret[k] = cls.from_dict(v)
+      else:
+        ret[k] = v
+    return ret
+
+  def to_dict(self) -> dict:
+    ret = {}
+    for k, v in self.items():
+      if isinstance(v, ConfigDict):
+        ret[k] = v.to_dict()
+      else:
+        ret[k] = v
+    return ret
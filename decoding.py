@@ -0,0 +1,211 @@
+import av
+import collections
+import dataclasses
+import functools
+import gc
+import os
+import threading
+import time
+
+import jax
+from JaxVidFlow import video_reader
+
+import cache_dirs
+
+@dataclasses.dataclass
+class VideoInfo:
+  width: int
+  height: int
+  frame_rate: float
+  duration: float
+  num_frames: int
+  decoder_name: str
+
+@functools.cache
+def guess_hardware_decoders() -> list[tuple[str, str]]:
+  # We create a list of everything by preference first, then filter by what's available.
+  candidates = [
+    # On modern Macs all accelerated decodes goes through VideoToolbox.
+    ('videotoolbox', 'Apple VideoToolbox'),
+
+    # On Windows we have both vendor-specific APIs and D3D11/12 VA. Vendor-specific APIs may
+    # be faster, but let's prefer D3D11/12 VA for now because it should support everything on
+    # Windows, and this way we don't have to rely on vendor-specific APIs failing gracefully
+    # so we can fallback. In the future if we know some APIs do fail gracefully, we can move
+    # them up above these.
+    ('d3d12va', 'Direct3D 12 Video Acceleration'),
+    ('d3d11va', 'Direct3D 11 Video Acceleration'),
+
+    # On Linux there's VA-API that's supported by Intel and AMD, and cuda for NVIDIA. Hopefully
+    # VA-API does fail gracefully, so we put that first, and then the vendor-specific APIs.
+    ('vaapi', 'Video Acceleration API'),
+
+    ('cuda', 'NVIDIA NVDEC'),
+    ('qsv', 'Intel QuickSync'),
+  ]
+
+  available = av.codec.hwaccel.hwdevices_available()
+  ret = []
+  for candidate in candidates:
+    if candidate[0] in available:
+      ret.append(candidate)
+  return ret
+
+# Number of frames to decode with each decoder when probing, and how many of those to leave out of the timing (the first
+# frames include setting up the decoder).
+_PROBE_FRAMES = 8
+_PROBE_WARMUP_FRAMES = 2
+
+_SOFTWARE = 'software'
+
+_CHOICES_VERSION = 1
+
+# What a decoder choice depends on. Hardware decoders often only support some profiles, bit depths and resolutions of a
+# codec, so eg. a failure on 10-bit HEVC says nothing about 8-bit H.264.
+@dataclasses.dataclass(frozen=True)
+class StreamKey:
+  codec: str
+  profile: str
+  bit_depth: int
+  width: int
+  height: int
+
+  def cache_key(self) -> str:
+    # Include the available hwaccels, so we probe again if they change (eg. new GPU or drivers).
+    hwaccels = ','.join(hwaccel for hwaccel, _ in guess_hardware_decoders())
+    return f'{self.codec}/{self.profile}/{self.bit_depth}/{self.width}x{self.height}/{hwaccels}'
+
+def stream_key(path: str) -> StreamKey:
+  with av.open(path) as container:
+    codec_context = container.streams.video[0].codec_context
+    pix_fmt = codec_context.format
+    bit_depth = pix_fmt.components[0].bits if pix_fmt is not None and pix_fmt.components else 8
+    return StreamKey(codec=codec_context.name, profile=str(codec_context.profile), bit_depth=bit_depth,
+                     width=codec_context.width, height=codec_context.height)
+
+# Hwaccels that failed to open, per stream key, in this process.
+_failed_hwaccels: dict[StreamKey, set[str]] = collections.defaultdict(set)
+
+# Serialises the read-modify-write of the choices file between threads of this process (the preview, the proxy
+# thread and in-process renders). Between processes, at worst a concurrent choice is lost and probed again.
+_choices_lock = threading.Lock()
+
+def _choices_path() -> str:
+  return os.path.join(cache_dirs.cache_dir('decoders'), f'choices_v{_CHOICES_VERSION}.json')
+
+def _load_choices() -> dict[str, str]:
+  return cache_dirs.load_json(_choices_path()) or {}
+
+def _save_choice(key: StreamKey, hwaccel: str | None) -> None:
+  with _choices_lock:
+    choices = _load_choices()
+    if hwaccel is None:
+      choices.pop(key.cache_key(), None)
+    else:
+      choices[key.cache_key()] = hwaccel
+    cache_dirs.save_json_atomic(_choices_path(), choices)
+
+def _open_reader(path: str, hwaccel: str) -> video_reader.VideoReader:
+  if hwaccel == _SOFTWARE:
+    return video_reader.VideoReader(filename=path)
+  return video_reader.VideoReader(filename=path, hwaccel=hwaccel)
+
+# Returns seconds per frame for decoding path with hwaccel, or None if it doesn't work.
+def _time_decoder(path: str, hwaccel: str) -> float | None:
+  reader = None
+  frame = None
+  try:
+    reader = _open_reader(path, hwaccel)
+    start_time = None
+    num_timed = 0
+    for i in range(_PROBE_FRAMES):
+      if i == _PROBE_WARMUP_FRAMES:
+        start_time = time.perf_counter()
+      try:
+        frame = next(reader)
+      except StopIteration:
+        break
+      jax.block_until_ready(frame.data)
+      if start_time is not None:
+        num_timed += 1
+  except Exception as e:
+    print(f'{hwaccel} failed to decode {path}: {e}')
+    return None
+  finally:
+    # Free the reader before probing the next decoder, so we don't run out of hardware contexts and blame the next
+    # decoder for it.
+    del reader, frame
+    gc.collect()
+  if num_timed == 0:
+    # Too short to time, but it works.
+    return 0.0
+  return (time.perf_counter() - start_time) / num_timed
+
+# Test decodes a few frames with every available decoder. Returns the fastest one that works, and whether all of them
+# could be timed. A decoder can also fail for reasons that have nothing to do with the stream (eg. other processes
+# probing at the same time taking up the hardware contexts), so a choice made with failures shouldn't be kept.
+def _probe(path: str, key: StreamKey) -> tuple[str, bool]:
+  complete = True
+  best_hwaccel = _SOFTWARE
+  best_time = _time_decoder(path, _SOFTWARE)
+  for hwaccel, _ in guess_hardware_decoders():
+    if hwaccel in _failed_hwaccels[key]:
+      complete = False
+      continue
+    decode_time = _time_decoder(path, hwaccel)
+    if decode_time is None:
+      _failed_hwaccels[key].add(hwaccel)
+      complete = False
+    elif best_time is None or decode_time < best_time:
+      best_hwaccel, best_time = hwaccel, decode_time
+  print(f'Decoder for {key.cache_key()}: {best_hwaccel}')
+  return best_hwaccel, complete and best_time is not None
+
+def _decoder_display_name(hwaccel: str) -> str:
+  for candidate, candidate_name in guess_hardware_decoders():
+    if candidate == hwaccel:
+      return candidate_name
+  return 'Software'
+
+# Opens a reader for path with the fastest decoder for its codec, profile, bit depth and resolution, probing the
+# decoders the first time we see a combination. Returns the reader and the decoder name to display.
+def open_video_reader(path: str) -> tuple[video_reader.VideoReader, str]:
+  try:
+    key = stream_key(path)
+  except Exception as e:
+    # Let the reader report the problem with the file.
+    print(f'Failed to probe {path}: {e}')
+    return video_reader.VideoReader(filename=path), 'Software'
+
+  hwaccel = _load_choices().get(key.cache_key())
+  if hwaccel is None or hwaccel in _failed_hwaccels[key]:
+    hwaccel, complete = _probe(path, key)
+    if complete:
+      _save_choice(key, hwaccel)
+
+  if hwaccel != _SOFTWARE:
+    try:
+      return _open_reader(path, hwaccel), _decoder_display_name(hwaccel)
+    except Exception as e:
+      # Worked when probing but not now (eg. out of hardware contexts). Probe again next time.
+      print(e)
+      _failed_hwaccels[key].add(hwaccel)
+      _save_choice(key, None)
+
+  return video_reader.VideoReader(filename=path), 'Software'
+
+def get_video_info(reader: video_reader.VideoReader, decoder_name: str) -> VideoInfo:
+  # Some formats don't record number of frames, so we estimate using duration and frame rate instead
+  # (assuming constant frame rate).
+  num_frames = reader.num_frames()
+  if num_frames is None or num_frames == 0:
+    num_frames = round(reader.duration() * reader.frame_rate())
+
+  return VideoInfo(
+    width=reader.width(),
+    height=reader.height(),
+    frame_rate=reader.frame_rate(),
+    duration=reader.duration(),
+    num_frames=num_frames,
+    decoder_name=decoder_name,
+  )
@@ -0,0 +1,36 @@
+import collections
+import threading
+from typing import Any, Hashable
+
+# LRU cache with a memory budget. Values can be anything, and the caller tells us how many bytes each one takes.
+class FrameCache:
+  def __init__(self, budget_bytes: int):
+    self._budget_bytes = budget_bytes
+    self._entries = collections.OrderedDict()
+    self._size_bytes = 0
+    self._lock = threading.Lock()
+
+  def get(self, key: Hashable) -> Any | None:
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None:
+        return None
+      self._entries.move_to_end(key)
+      return entry[0]
+
+  def put(self, key: Hashable, value: Any, size_bytes: int) -> None:
+    if size_bytes > self._budget_bytes:
+      return
+    with self._lock:
+      if key in self._entries:
+        self._size_bytes -= self._entries.pop(key)[1]
+      self._entries[key] = (value, size_bytes)
+      self._size_bytes += size_bytes
+      while self._size_bytes > self._budget_bytes:
+        _, (_, evicted_size) = self._entries.popitem(last=False)
+        self._size_bytes -= evicted_size
+
+  def clear(self) -> None:
+    with self._lock:
+      self._entries.clear()
+      self._size_bytes = 0
@@ -0,0 +1,86 @@
+# Index of the presentation times of all frames in a video, and which of them are keyframes. Building it only demuxes
+# the file (no decoding), and the result is cached in a sidecar file keyed by a hash of the video file.
+#
+# With the index we can give the exact number of frames, seek to the exact time of a frame, and know whether a seek
+# target is in the same GOP as where the reader is, in which case decoding forward is cheaper than seeking.
+
+import dataclasses
+
+import av
+import numpy as np
+
+import cache_dirs
+
+_INDEX_VERSION = 1
+
+@dataclasses.dataclass
+class KeyframeIndex:
+  # (N,) presentation times of all frames in seconds, increasing.
+  frame_times: np.ndarray
+
+  # Presentation times of keyframes in seconds, increasing.
+  keyframe_times: np.ndarray
+
+  def num_frames(self) -> int:
+    return len(self.frame_times)
+
+  # Index of the frame closest to frame_time.
+  def frame_index(self, frame_time: float) -> int:
+    idx = int(np.searchsorted(self.frame_times, frame_time))
+    idx = min(max(idx, 0), len(self.frame_times) - 1)
+    if idx > 0 and abs(self.frame_times[idx - 1] - frame_time) < abs(self.frame_times[idx] - frame_time):
+      idx -= 1
+    return idx
+
+  def frame_time(self, index: int) -> float:
+    return float(self.frame_times[min(max(index, 0), len(self.frame_times) - 1)])
+
+  # Time of the last keyframe at or before frame_time.
+  def keyframe_before(self, frame_time: float) -> float:
+    idx = int(np.searchsorted(self.keyframe_times, frame_time, side='right')) - 1
+    return float(self.keyframe_times[max(idx, 0)])
+
+  # Whether decoding forward from from_index to to_index is no more work than seeking to to_index, because there is no
+  # keyframe in between to seek to.
+  def same_gop(self, from_index: int, to_index: int) -> bool:
+    return (to_index >= from_index and
+            self.keyframe_before(self.frame_time(to_index)) <= self.frame_time(from_index))
+
+def build(path: str) -> KeyframeIndex:
+  frame_times = []
+  keyframe_times = []
+  with av.open(path) as container:
+    stream = container.streams.video[0]
+    for packet in container.demux(stream):
+      # The flush packet at the end has no timestamp.
+      if packet.pts is None:
+        continue
+      packet_time = float(packet.pts * stream.time_base)
+      frame_times.append(packet_time)
+      if packet.is_keyframe:
+        keyframe_times.append(packet_time)
+  # Packets are in decode order, which is different from presentation order with B-frames.
+  frame_times = np.sort(np.array(frame_times, dtype=np.float64))
+  keyframe_times = np.sort(np.array(keyframe_times, dtype=np.float64))
+  if len(keyframe_times) == 0 and len(frame_times) > 0:
+    keyframe_times = frame_times[:1]
+  return KeyframeIndex(frame_times=frame_times, keyframe_times=keyframe_times)
+
+def index_path(path: str) -> str:
+  return cache_dirs.sidecar_path('keyframe_index', path, _INDEX_VERSION, 'npz')
+
+# Returns the cached index, or None if we haven't built one for this file yet.
+def load_cached(path: str) -> KeyframeIndex | None:
+  data = cache_dirs.load_npz(index_path(path))
+  if data is None:
+    return None
+  return KeyframeIndex(frame_times=data['frame_times'], keyframe_times=data['keyframe_times'])
+
+def load_or_build(path: str) -> KeyframeIndex:
+  index = load_cached(path)
+  if index is not None:
+    return index
+  index = build(path)
+  if index.num_frames() > 0:
+    cache_dirs.save_npz_atomic(index_path(path), frame_times=index.frame_times, keyframe_times=index.keyframe_times)
+  return index
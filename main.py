@@ -13,8 +13,12 @@ import random
 
 from PySide6 import QtCore, QtMultimedia, QtMultimediaWidgets, QtWidgets, QtGui
 
+import batch_processor
 import config_block
 import np_qt_adapter
+import playback_clock
+import process
+import proxy_transcoder
 import video_processor
 
 signal.signal(signal.SIGINT, signal.SIG_DFL)
@@ -22,6 +26,21 @@ signal.signal(signal.SIGINT, signal.SIG_DFL)
 # Allowed extensions for videos.
 _ALLOWED_EXTENSIONS = [ 'mp4', 'mkv', 'mov', 'avi' ]
 
+# Preview proxy options (fraction of native resolution). None is automatic, where we start at full resolution for
+# each video, drop to the next proxy level when playback can't keep up, and go back up when there's plenty of headroom.
+_PROXY_OPTIONS = [('Auto', None), ('Full', 1.0), ('1/2', 0.5), ('1/4', 0.25), ('1/8', 0.125)]
+
+# Number of consecutive slow frames during playback before automatic proxy mode drops to a lower resolution.
+_SLOW_FRAMES_BEFORE_PROXY_FALLBACK = 10
+
+# Number of consecutive fast frames during playback before automatic proxy mode goes back up a level. A frame is fast
+# if decoding and processing it took less than this fraction of the frame duration. The next level up has about 4x the
+# pixels, so this leaves room for that without immediately falling back again. This goes by the processing time rather
+# than the request latency, since requests are served from the prefetched frames in no time whenever playback keeps
+# up, however much the frames cost.
+_FAST_FRAMES_BEFORE_PROXY_RESTORE = 60
+_PROXY_RESTORE_MAX_TIME_FRACTION = 0.2
+
 def _pretty_duration(seconds: float, total_seconds: float | None = None) -> str:
   to_convert = datetime.timedelta(seconds=seconds)
   # If provided, use total_seconds to determine format (whether to show hour or not), and use it to format seconds.
@@ -71,10 +90,14 @@ def _dll_extension() -> str:
 
 class MainWidget(QtWidgets.QWidget):
 
-  selected_video_changed = QtCore.Signal(str)
-  request_one_frame = QtCore.Signal(int, int, bool, bool, config_block.ConfigDict)
+  # path, whether to preview from a proxy if there is one
+  selected_video_changed = QtCore.Signal(str, bool)
+  request_one_frame = QtCore.Signal(int, int, bool, bool, config_block.ConfigDict, float, int)
   unload_video = QtCore.Signal()
   seek_requested = QtCore.Signal(float)
+  playing_changed = QtCore.Signal(bool)
+  proxy_scale_changed = QtCore.Signal(float)
+  process_files_requested = QtCore.Signal(list, str, config_block.ConfigDict)
 
   def __init__(self, app):
     super().__init__()
@@ -102,6 +125,16 @@ class MainWidget(QtWidgets.QWidget):
     self._video_processor.moveToThread(self._video_processor_thread)
     app.aboutToQuit.connect(self._video_processor_thread.quit)
 
+    # Batch processing gets its own thread, so preview stays responsive while we render.
+    self._batch_processor_thread = QtCore.QThread()
+    self._batch_processor = batch_processor.BatchProcessor()
+    self._batch_processor.moveToThread(self._batch_processor_thread)
+    app.aboutToQuit.connect(self._batch_processor_thread.quit)
+    self._batch_processing = False
+
+    # Proxies are made one file at a time in the background, and used the next time a file is loaded for preview.
+    self._proxy_queue = proxy_transcoder.ProxyQueue()
+
     # This keeps track of whether we have a frame request pending. If we do, there's no point queuing up seek signals or
     # more frame requests, because by the time the frame returns, we may want to be somewhere else already. This is mostly
     # for dragging the timeline or config sliders, which would otherwise generate a lot of seek signals, and a lot of
@@ -113,7 +146,14 @@ class MainWidget(QtWidgets.QWidget):
     self._config_changed = False
 
     self._is_playing = False
-    self._next_frame_display_time = 0.0
+    self._playback_clock = playback_clock.PlaybackClock()
+    self._frame_request_time = 0.0
+
+    # Incremented on every seek and play/stop, so frames and requests scheduled before that are dropped.
+    self._playback_generation = 0
+
+    # Generation of the last frame request, so we can tell frames requested before a seek from the ones after.
+    self._frame_request_generation = 0
 
     # Left file list + file info.
     self._path_prefix_label = QtWidgets.QLabel('./')
@@ -124,10 +164,13 @@ class MainWidget(QtWidgets.QWidget):
     add_folder_button = QtWidgets.QPushButton('Add Folder')
     self._remove_file_button = QtWidgets.QPushButton('Remove')
     self._remove_file_button.setEnabled(False)
+    self._make_proxies_checkbox = QtWidgets.QCheckBox('Make low resolution proxies for preview')
+    self._make_proxies_checkbox.setChecked(self._settings.value('make_proxies', False, type=bool))
 
     add_files_button.clicked.connect(self.open_files_dialog)
     add_folder_button.clicked.connect(self.open_dir_dialog)
     self._remove_file_button.clicked.connect(self.remove_file_clicked)
+    self._make_proxies_checkbox.checkStateChanged.connect(self.make_proxies_changed)
     self._file_list.itemSelectionChanged.connect(self.video_multi_selection_changed)
     self._file_list.currentTextChanged.connect(self.video_single_selection_changed)
 
@@ -144,6 +187,13 @@ class MainWidget(QtWidgets.QWidget):
     self._video_position_text.setFont(_monospace_font())
     self._preview_enable_checkbox = QtWidgets.QCheckBox('Preview')
     self._preview_enable_checkbox.setChecked(True)
+    self._proxy_combobox = QtWidgets.QComboBox()
+    for proxy_display, proxy_scale in _PROXY_OPTIONS:
+      self._proxy_combobox.addItem(f'Proxy: {proxy_display}', proxy_scale)
+    self._proxy_combobox.setCurrentIndex(int(self._settings.value('proxy_index', 0)))
+    self._auto_proxy_scale = 1.0
+    self._num_slow_frames = 0
+    self._num_fast_frames = 0
 
     # Processing status and output folder.
     output_path_label = QtWidgets.QLabel('Output path (relative to file): ')
@@ -162,6 +212,7 @@ class MainWidget(QtWidgets.QWidget):
     input_files_group_v_layout.addWidget(self._path_prefix_label)
     input_files_group_v_layout.addWidget(self._file_list)
     input_files_group_v_layout.addLayout(file_list_controls_layout)
+    input_files_group_v_layout.addWidget(self._make_proxies_checkbox)
     left_v_layout = QtWidgets.QVBoxLayout()
     left_v_layout.addWidget(input_files_group)
     media_info_group = QtWidgets.QGroupBox('Media Info')
@@ -181,6 +232,7 @@ class MainWidget(QtWidgets.QWidget):
     preview_controls_layout.addWidget(self._frame_slider, 1)
     preview_controls_layout.addWidget(self._video_position_text, 0)
     preview_controls_layout.addWidget(self._preview_enable_checkbox)
+    preview_controls_layout.addWidget(self._proxy_combobox)
     preview_controls_layout.setSpacing(5)
     preview_controls_layout.setAlignment(QtCore.Qt.AlignTop)
     mid_v_layout.addWidget(self._preview_controls_container)
@@ -219,6 +271,7 @@ class MainWidget(QtWidgets.QWidget):
         checkable=True,
         elements=[
           config_block.ConfigFloat(key='gamma', display_name='Gamma Correction', default_value=1.1, min_value=0.5, max_value=2.0, resolution=0.01, places=2),
+          config_block.ConfigBool(key='lookup_table', display_name='Use lookup table (faster on some devices)', default_value=False),
         ]
       ),
       config_block.ConfigBlockSpec(
@@ -228,6 +281,7 @@ class MainWidget(QtWidgets.QWidget):
         elements=[
           config_block.ConfigFloat(key='max_gain', display_name='Max Gain', default_value=10, min_value=1, max_value=25, places=1),
           config_block.ConfigFloat(key='temporal_smoothing', display_name='Temporal Smoothing', default_value=0.95, min_value=0.0, max_value=1.0, resolution=0.001, places=3),
+          config_block.ConfigBool(key='two_pass', display_name='Analyse whole clip before processing', default_value=True),
         ]
       ),
       config_block.ConfigBlockSpec(
@@ -245,6 +299,12 @@ class MainWidget(QtWidgets.QWidget):
         checkable=False,
         elements=[
           config_block.ConfigBool(key='side_by_side', display_name='Side by side (processed/original)', default_value=False),
+          config_block.ConfigBool(key='rotate_with_metadata', display_name='Rotate with metadata instead of pixels (faster)', default_value=False),
+          config_block.ConfigEnum(key='precision', display_name='Export Precision (without Gyroflow)', default_index=0, options=[
+              ('Float32', 'float32'),
+              ('Float16', 'float16'),
+              ('BFloat16', 'bfloat16')
+          ]),
         ]
       ),
       config_block.ConfigBlockSpec(
@@ -290,33 +350,54 @@ class MainWidget(QtWidgets.QWidget):
     self.request_one_frame.connect(self._video_processor.request_one_frame)
     self.seek_requested.connect(self._video_processor.request_seek_to)
     self.unload_video.connect(self._video_processor.unload_video)
+    self.playing_changed.connect(self._video_processor.set_playing)
+    self.proxy_scale_changed.connect(self._video_processor.set_proxy_scale)
     self._video_processor.frame_decoded.connect(self.frame_received)
     self._video_processor.eof.connect(self.eof_received)
     self._video_processor.new_video_info.connect(self.update_video_info)
+    self._video_processor.video_info_updated.connect(self.refine_video_info)
     self._frame_slider.sliderMoved.connect(self.frame_slider_moved)
     self._frame_slider.sliderPressed.connect(self.frame_slider_pressed)
     self._preview_play_stop_button.clicked.connect(self._play_stop_clicked)
+    self.process_files_requested.connect(self._batch_processor.request_process_files)
+    self._batch_processor.progress.connect(self._process_progress_text.setText)
+    self._batch_processor.finished.connect(self.batch_processing_finished)
+    self._process_button.clicked.connect(self.process_clicked)
 
     self._preview_enable_checkbox.checkStateChanged.connect(self.configs_changed)
+    self._proxy_combobox.currentIndexChanged.connect(self.proxy_mode_changed)
 
     self._video_processor_thread.start()
+    self._batch_processor_thread.start()
+
+    self.proxy_scale_changed.emit(self._proxy_scale())
 
     self._video_loaded = False
 
     self.configs_changed()
     self.video_multi_selection_changed()
     self.opened_files_updated()
+    # Files from last time that don't have proxies yet.
+    self.make_proxies_changed()
 
   def closeEvent(self, event):
+    # The batch processor thread only gets to quit() once the render returns, and that only returns once the worker
+    # pool has shut down, so after the wait there are no workers left writing partial files.
+    self._batch_processor.request_stop()
+    self._batch_processor_thread.quit()
+    self._batch_processor_thread.wait()
+    self._video_processor_thread.quit()
+    self._video_processor_thread.wait()
+    self._proxy_queue.stop()
+
     self._settings.setValue('opened_files', self._opened_files)
     self._settings.setValue('output_path', self._output_path_field.text())
+    self._settings.setValue('proxy_index', self._proxy_combobox.currentIndex())
+    self._settings.setValue('make_proxies', self._make_proxies_checkbox.isChecked())
     self._settings.setValue('window_pos', self.pos())
     self._settings.setValue('window_size', self.size())
 
-    all_configs = config_block.ConfigDict()
-    for block in self._config_blocks:
-      all_configs[block.name()] = block.to_config_dict()
-    all_configs.save_to_settings(self._settings)
+    self._all_configs().save_to_settings(self._settings)
 
   @QtCore.Slot()
   def configs_changed(self):
@@ -365,7 +446,9 @@ class MainWidget(QtWidgets.QWidget):
       full_path = os.path.join(self._common_prefix, filename)
       self._opened_file_label.setText(full_path)
       self._set_playing(False)
-      self.selected_video_changed.emit(full_path)
+      # A new video may be cheaper to decode, so automatic proxy mode starts again from full resolution.
+      self._set_auto_proxy_scale(1.0)
+      self.selected_video_changed.emit(full_path, self._use_proxy())
       self._video_loaded = True
       self._request_new_frame()
       self._current_video_file = full_path
@@ -384,9 +467,39 @@ class MainWidget(QtWidgets.QWidget):
     else:
       self._remove_file_button.setEnabled(True)
       self._process_button.setEnabled(True)
+    if self._batch_processing:
+      # The process button is the cancel button while we are processing.
+      self._process_button.setEnabled(True)
+
+  @QtCore.Slot()
+  def process_clicked(self):
+    if self._batch_processing:
+      self._batch_processor.request_stop()
+      self._process_button.setEnabled(False)
+      return
+    paths = [os.path.join(self._common_prefix, item.text()) for item in self._file_list.selectedItems()]
+    if not paths:
+      return
+    self._batch_processing = True
+    self._process_button.setText('Cancel')
+    self.process_files_requested.emit(paths, self._output_path_field.text(), self._all_configs())
+
+  @QtCore.Slot()
+  def batch_processing_finished(self):
+    self._batch_processing = False
+    self._process_button.setText('Process Selected')
+    self._process_button.setEnabled(len(self._file_list.selectedItems()) > 0)
 
   @QtCore.Slot()
   def update_video_info(self, video_info):
+    self.refine_video_info(video_info)
+    self._frame_slider.setValue(0)
+    self._frame_slider.setMinimum(0)
+    self._preview_controls_container.setEnabled(True)
+
+  @QtCore.Slot()
+  def refine_video_info(self, video_info):
+    # Same video, but with more accurate info, so we don't reset the position.
     self._video_info = video_info
     self._media_info.setText(
       f'Resolution: {video_info.width}x{video_info.height}\n'
@@ -394,31 +507,49 @@ class MainWidget(QtWidgets.QWidget):
       f'Duration: {_pretty_duration(video_info.duration)}\n'
       f'Num Frames: {video_info.num_frames}\n'
       f'Decoder: {video_info.decoder_name}')
-    self._frame_slider.setValue(0)
-    self._frame_slider.setMinimum(0)
     self._frame_slider.setMaximum(video_info.num_frames)
-    self._preview_controls_container.setEnabled(True)
 
   @QtCore.Slot()
-  def frame_received(self, frame: QtMultimedia.QVideoFrame, frame_time: float):
+  def frame_received(self, frame: QtMultimedia.QVideoFrame, frame_time: float, request_generation: int,
+                     processing_time: float):
     now = time.time()
-    last_frame_update_time = self._next_frame_display_time - 1.0 / self._video_info.frame_rate
-    if now >= self._next_frame_display_time:
+    generation = self._playback_generation
+    # Frames requested before the last seek or play/stop are not on the current timeline, so they must not anchor the
+    # clock (and aren't worth showing during playback).
+    stale = request_generation != generation
+    if stale and self._frame_request_generation != request_generation:
+      # We have already asked for a frame on the current timeline, and that one will take it from here.
+      return
+    display_time = now
+    if self._is_playing and not stale:
+      if not self._playback_clock.running():
+        # First frame since we started playing or seeked. Frames after this are shown relative to it.
+        self._playback_clock.start(frame_time, self._video_info.frame_rate, now)
+      self._playback_clock.record_latency(now - self._frame_request_time)
+      self._playback_clock.frame_shown(frame_time)
+      display_time = self._playback_clock.wall_time(frame_time)
+    # During playback, stale frames are not shown, since the frame for the new position follows right after.
+    show_frame = not (self._is_playing and stale)
+    if show_frame and display_time <= now:
       self._update_preview(frame, frame_time)
-    else:
-      delay_ms = round((self._next_frame_display_time - now) * 1000)
-      QtCore.QTimer.singleShot(delay_ms, lambda: self._update_preview(frame, frame_time))
-    
-    if self._is_playing:
-      decode_time = now - last_frame_update_time
-      max_fps = 1.0 / max(decode_time, 0.0001)
+    elif show_frame:
+      delay_ms = round((display_time - now) * 1000)
+      QtCore.QTimer.singleShot(delay_ms, lambda: self._update_preview(frame, frame_time, generation))
+
+    if self._is_playing and not stale and not self._batch_processing:
+      latency = self._playback_clock.latency()
+      max_fps = 1.0 / max(latency, 0.0001)
       too_slow = max_fps < self._video_info.frame_rate
+      frames_dropped = self._playback_clock.frames_dropped
+      frames_total = self._playback_clock.frames_shown + frames_dropped
       self._process_progress_text.setText(
-        f'Preview decode time: {(decode_time * 1000):.2f}ms (<= {max_fps:.1f} FPS) ({frame.width()}x{frame.height()})'
-        f'{"(Slow decode)" if too_slow else ""}')
+        f'Preview frame time: {(latency * 1000):.2f}ms (<= {max_fps:.1f} FPS) ({frame.width()}x{frame.height()}) '
+        f'Dropped: {frames_dropped}/{frames_total}{" (Slow decode)" if too_slow else ""}')
+      self._update_auto_proxy(too_slow, processing_time)
 
     self._frame_request_pending = False
     if self._next_seek_to_time is not None:
+      self._restart_playback_clock()
       self.seek_requested.emit(self._next_seek_to_time)
       self._request_new_frame()
       self._next_seek_to_time = None
@@ -426,6 +557,77 @@ class MainWidget(QtWidgets.QWidget):
       self._request_new_frame(try_reuse_frame=True)
       self._config_changed = False
 
+    # Ask for the next frame so it arrives about when it's due, rather than only after this one is shown, so processing
+    # overlaps with waiting.
+    if self._is_playing and not self._frame_request_pending and not self._playback_clock.running():
+      # We dropped a stale frame, and the clock starts again with the next one.
+      self._request_new_frame()
+    elif self._is_playing and not self._frame_request_pending:
+      request_time = self._playback_clock.next_request_time(frame_time)
+      if request_time <= now:
+        self._request_next_playback_frame(generation)
+      else:
+        delay_ms = round((request_time - now) * 1000)
+        QtCore.QTimer.singleShot(delay_ms, lambda: self._request_next_playback_frame(generation))
+
+  def _request_next_playback_frame(self, generation: int) -> None:
+    if (generation != self._playback_generation or not self._is_playing or self._frame_request_pending or
+        not self._playback_clock.running()):
+      return
+    # Frames that would arrive after they are due are skipped by the video processor.
+    self._request_new_frame(min_frame_time=self._playback_clock.min_frame_time(time.time()))
+
+  def _restart_playback_clock(self) -> None:
+    self._playback_clock.stop()
+    self._playback_generation += 1
+
+  @QtCore.Slot()
+  def proxy_mode_changed(self):
+    self.proxy_scale_changed.emit(self._proxy_scale())
+    self._reload_for_proxy_change()
+    self.configs_changed()
+
+  # Proxies are only for users who opted in to making them, and not when asking for full resolution.
+  def _use_proxy(self) -> bool:
+    return self._make_proxies_checkbox.isChecked() and self._proxy_combobox.currentData() != 1.0
+
+  def _reload_for_proxy_change(self) -> None:
+    # The video processor keeps the position when only the proxy choice changes.
+    if self._video_loaded:
+      self.selected_video_changed.emit(self._current_video_file, self._use_proxy())
+
+  def _proxy_scale(self) -> float:
+    proxy_scale = self._proxy_combobox.currentData()
+    return self._auto_proxy_scale if proxy_scale is None else proxy_scale
+
+  # processing_time is 0 for frames from the cache, which say nothing about what frames at this scale cost, so they
+  # don't count towards going back up.
+  def _update_auto_proxy(self, too_slow: bool, processing_time: float) -> None:
+    if self._proxy_combobox.currentData() is not None:
+      return
+    self._num_slow_frames = self._num_slow_frames + 1 if too_slow else 0
+    if processing_time > 0.0:
+      fast = processing_time < _PROXY_RESTORE_MAX_TIME_FRACTION / self._video_info.frame_rate
+      self._num_fast_frames = self._num_fast_frames + 1 if fast else 0
+    lowest_scale = min(proxy_scale for _, proxy_scale in _PROXY_OPTIONS if proxy_scale is not None)
+    if self._num_slow_frames >= _SLOW_FRAMES_BEFORE_PROXY_FALLBACK and self._auto_proxy_scale > lowest_scale:
+      self._set_auto_proxy_scale(self._auto_proxy_scale / 2)
+    elif self._num_fast_frames >= _FAST_FRAMES_BEFORE_PROXY_RESTORE and self._auto_proxy_scale < 1.0:
+      self._set_auto_proxy_scale(self._auto_proxy_scale * 2)
+
+  def _set_auto_proxy_scale(self, scale: float) -> None:
+    self._num_slow_frames = 0
+    self._num_fast_frames = 0
+    if scale == self._auto_proxy_scale:
+      return
+    self._auto_proxy_scale = scale
+    if scale == 1.0:
+      self._proxy_combobox.setItemText(0, 'Proxy: Auto')
+    else:
+      self._proxy_combobox.setItemText(0, f'Proxy: Auto ({scale:g}x)')
+    if self._proxy_combobox.currentData() is None:
+      self.proxy_scale_changed.emit(scale)
+
   @QtCore.Slot()
   def eof_received(self):
     self._video_position_text.setText(_pretty_duration(self._video_info.duration, self._video_info.duration))
@@ -434,13 +636,16 @@ class MainWidget(QtWidgets.QWidget):
 
     self._frame_request_pending = False
     if self._next_seek_to_time is not None:
+      self._restart_playback_clock()
       self.seek_requested.emit(self._next_seek_to_time)
       self._request_new_frame()
       self._next_seek_to_time = None
 
   @QtCore.Slot()
-  def _update_preview(self, frame: QtMultimedia.QVideoFrame, frame_time: float) -> None:
-    now = time.time()
+  def _update_preview(self, frame: QtMultimedia.QVideoFrame, frame_time: float, generation: int | None = None) -> None:
+    if generation is not None and generation != self._playback_generation:
+      # We seeked or stopped after this was scheduled.
+      return
     self._preview_video_widget.videoSink().setVideoFrame(frame)
 
     # Use duration to format frame time, so that if the video is over an hour, frame time is always shown
@@ -448,21 +653,24 @@ class MainWidget(QtWidgets.QWidget):
     self._video_position_text.setText(_pretty_duration(frame_time, self._video_info.duration))
 
     if self._is_playing:
-      frame_duration = 1.0 / self._video_info.frame_rate
       slider_value = round((frame_time / self._video_info.duration) * self._video_info.num_frames)
       self._frame_slider.setValue(slider_value)
-      self._next_frame_display_time = now + frame_duration
-      self._request_new_frame()
 
-  def _request_new_frame(self, try_reuse_frame=False):
-    self._frame_request_pending = True
+  def _all_configs(self) -> config_block.ConfigDict:
     all_configs = config_block.ConfigDict()
     for block in self._config_blocks:
       all_configs[block.name()] = block.to_config_dict()
+    return all_configs
+
+  def _request_new_frame(self, try_reuse_frame=False, min_frame_time=0.0):
+    self._frame_request_pending = True
+    self._frame_request_time = time.time()
+    self._frame_request_generation = self._playback_generation
     process = self._preview_enable_checkbox.isChecked()
-    self.request_one_frame.emit(self._preview_video_widget.width(), self._preview_video_widget.height(), try_reuse_frame, process, all_configs)
+    self.request_one_frame.emit(self._preview_video_widget.width(), self._preview_video_widget.height(), try_reuse_frame, process, self._all_configs(), min_frame_time, self._frame_request_generation)
 
   def _schedule_seek(self, frame_time, start_playing=False):
+    self._restart_playback_clock()
     if self._frame_request_pending:
       self._next_seek_to_time = frame_time
     else:
@@ -488,6 +696,8 @@ class MainWidget(QtWidgets.QWidget):
 
   def _set_playing(self, playing):
     self._is_playing = playing
+    self._restart_playback_clock()
+    self.playing_changed.emit(playing)
     self._preview_play_stop_button.setText('⏹' if playing else '⏵')
     if playing:
       if self._frame_slider.value() == self._frame_slider.maximum():
@@ -507,8 +717,19 @@ class MainWidget(QtWidgets.QWidget):
     for file_name in file_names:
       if file_name not in self._opened_files:
         self._opened_files.append(os.path.normpath(file_name))
+      if self._make_proxies_checkbox.isChecked():
+        self._proxy_queue.add(os.path.normpath(file_name))
     self.opened_files_updated()
 
+  @QtCore.Slot()
+  def make_proxies_changed(self):
+    if self._make_proxies_checkbox.isChecked():
+      for path in self._opened_files:
+        self._proxy_queue.add(path)
+    if self._video_loaded:
+      self._reload_for_proxy_change()
+      self.configs_changed()
+
   def opened_files_updated(self):
     self._file_list.clear()
     if len(self._opened_files) == 0:
@@ -526,6 +747,8 @@ class MainWidget(QtWidgets.QWidget):
         QtWidgets.QListWidgetItem(short_name, self._file_list)    
 
 if __name__ == "__main__":
+  process.enable_compilation_cache()
+
   app = QtWidgets.QApplication([])
 
   app.setOrganizationName('ReefShader')
@@ -9,6 +9,14 @@ import numpy as np
 
 from PySide6 import QtCore, QtMultimedia
 
+# Qt rotations by clockwise angle.
+_QT_ROTATIONS = {
+  0: QtMultimedia.QtVideo.Rotation.None_,
+  90: QtMultimedia.QtVideo.Rotation.Clockwise90,
+  180: QtMultimedia.QtVideo.Rotation.Clockwise180,
+  270: QtMultimedia.QtVideo.Rotation.Clockwise270,
+}
+
 class ArrayInterfaceAroundQVideoFrame:
   def __init__(self, frame: QtMultimedia.QVideoFrame):
     self.__qvideoframe = frame
@@ -23,20 +31,53 @@ class ArrayInterfaceAroundQVideoFrame:
   def rgba_view(self):
     return np.asarray(self)
 
+# rotation is the counter-clockwise rotation to display the frame with (the convention of jnp.rot90 and the frames from
+# JaxVidFlow), which Qt applies when rendering, so we don't have to make a rotated copy.
 def array_to_qvideo_frame(
-    array: np.ndarray, frame_to_reuse: QtMultimedia.QVideoFrame | None = None) -> QtMultimedia.QVideoFrame:
+    array: np.ndarray, frame_to_reuse: QtMultimedia.QVideoFrame | None = None,
+    rotation: int = 0) -> QtMultimedia.QVideoFrame:
   h, w, c = array.shape
   assert c in (3, 4)
   pixel_format = QtMultimedia.QVideoFrameFormat.PixelFormat.Format_RGBX8888
   frame_format = QtMultimedia.QVideoFrameFormat(QtCore.QSize(w, h), pixel_format)
+  frame = None
   if frame_to_reuse is not None and frame_to_reuse.width() == w and frame_to_reuse.height() == h:
     frame = frame_to_reuse
-  else:
+    if not frame.map(QtMultimedia.QVideoFrame.MapMode.WriteOnly):
+      # Still mapped or otherwise in use somewhere, so we can't write into it.
+      frame = None
+  if frame is None:
     frame = QtMultimedia.QVideoFrame(frame_format)
-  frame.map(QtMultimedia.QVideoFrame.MapMode.WriteOnly)
-  array_interface = ArrayInterfaceAroundQVideoFrame(frame)
-  rgba_view = array_interface.rgba_view()
-  assert rgba_view.shape == (h, w, 4)
-  rgba_view[:, :, :c] = array
+    if not frame.map(QtMultimedia.QVideoFrame.MapMode.WriteOnly):
+      raise RuntimeError(f'Failed to map a new {w}x{h} QVideoFrame')
+  if c == 4 and frame.bytesPerLine(0) == w * 4 and array.flags['C_CONTIGUOUS']:
+    # Fast path for RGBX input (see process.convert_to_display) when the frame has no row padding. This is a single
+    # memcpy of the whole frame.
+    dst = np.frombuffer(frame.bits(0), dtype=np.uint8, count=h * w * 4)
+    np.copyto(dst, array.reshape(-1))
+  else:
+    array_interface = ArrayInterfaceAroundQVideoFrame(frame)
+    rgba_view = array_interface.rgba_view()
+    assert rgba_view.shape == (h, w, 4)
+    rgba_view[:, :, :c] = array
   frame.unmap()
+  frame.setRotation(_QT_ROTATIONS[(-rotation) % 360])
   return frame
+
+# A ring of QVideoFrames that we write new frames into, instead of allocating (and zeroing) a new frame every time.
+# QVideoFrame doesn't tell us when the sink has let go of a frame, so num_frames must be more than the number of frames
+# that can be in flight (queued or scheduled to be shown, or held by the sink) at once. Then by the time we come back
+# around the ring, the frame has been released. Frames that can't be mapped for writing are replaced with new ones.
+class VideoFramePool:
+  def __init__(self, num_frames: int):
+    self._frames = [None] * num_frames
+    self._next_idx = 0
+
+  def array_to_qvideo_frame(self, array: np.ndarray, rotation: int = 0) -> QtMultimedia.QVideoFrame:
+    frame = array_to_qvideo_frame(array, self._frames[self._next_idx], rotation=rotation)
+    self._frames[self._next_idx] = frame
+    self._next_idx = (self._next_idx + 1) % len(self._frames)
+    return frame
+
+  def clear(self):
+    self._frames = [None] * len(self._frames)
@@ -0,0 +1,109 @@
+# A simple staged pipeline. The source and each stage run on their own thread, connected by bounded queues, so
+# decoding, JAX dispatch and encoding/display can overlap. The bounded queues provide backpressure, so a fast stage
+# can only get a few items ahead of a slow one.
+#
+# This module must not import PySide6, because it's also used for batch rendering.
+
+import queue
+import threading
+from typing import Any, Callable, Sequence
+
+# How often blocked threads check whether the pipeline has been closed, in seconds.
+_POLL_INTERVAL = 0.05
+
+_END = object()
+
+class _Error:
+  def __init__(self, exception: Exception):
+    self.exception = exception
+
+class Pipeline:
+  # source is called repeatedly on the source thread, and should raise StopIteration when there are no more items.
+  # Each stage is called with the output of the previous stage on its own thread. A stage can return None to
+  # drop an item (eg. when Gyroflow needs another frame before it can output one).
+  def __init__(self, source: Callable[[], Any], stages: Sequence[Callable[[Any], Any]] = (), queue_size: int = 2):
+    self._stop = threading.Event()
+    self._queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    self._threads = [threading.Thread(target=self._run_source, args=(source, self._queues[0]), daemon=True)]
+    for stage_idx, stage in enumerate(stages):
+      self._threads.append(threading.Thread(
+        target=self._run_stage, args=(stage, self._queues[stage_idx], self._queues[stage_idx + 1]), daemon=True))
+    for thread in self._threads:
+      thread.start()
+    self._finished = False
+
+  def _put(self, q: queue.Queue, item: Any) -> bool:
+    while not self._stop.is_set():
+      try:
+        q.put(item, timeout=_POLL_INTERVAL)
+        return True
+      except queue.Full:
+        continue
+    return False
+
+  def _get(self, q: queue.Queue) -> Any:
+    while not self._stop.is_set():
+      try:
+        return q.get(timeout=_POLL_INTERVAL)
+      except queue.Empty:
+        continue
+    return _END
+
+  def _run_source(self, source: Callable[[], Any], output_queue: queue.Queue) -> None:
+    while not self._stop.is_set():
+      try:
+        item = source()
+      except StopIteration:
+        self._put(output_queue, _END)
+        return
+      except Exception as e:
+        self._put(output_queue, _Error(e))
+        return
+      if not self._put(output_queue, item):
+        return
+
+  def _run_stage(self, stage: Callable[[Any], Any], input_queue: queue.Queue, output_queue: queue.Queue) -> None:
+    while True:
+      item = self._get(input_queue)
+      if item is _END or isinstance(item, _Error):
+        # Pass end of stream and errors through to the consumer.
+        self._put(output_queue, item)
+        return
+      try:
+        result = stage(item)
+      except Exception as e:
+        self._put(output_queue, _Error(e))
+        return
+      if result is not None and not self._put(output_queue, result):
+        return
+
+  def __iter__(self):
+    return self
+
+  # Returns the next output of the last stage. Raises StopIteration at the end of the source, and re-raises
+  # exceptions from any stage.
+  def __next__(self) -> Any:
+    if self._finished:
+      raise StopIteration()
+    item = self._get(self._queues[-1])
+    if item is _END:
+      self._finished = True
+      raise StopIteration()
+    if isinstance(item, _Error):
+      self._finished = True
+      raise item.exception
+    return item
+
+  # Stops all threads and discards anything in flight. After this returns, no stage function is running, so
+  # it's safe to use (eg. seek) the source again.
+  def close(self) -> None:
+    self._stop.set()
+    for thread in self._threads:
+      thread.join()
+    self._finished = True
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
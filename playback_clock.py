@@ -0,0 +1,69 @@
+# Wall clock to media time mapping for preview playback. Once started, frame times map to fixed wall clock times, so
+# one slow frame doesn't delay all the frames after it. When frames can't be produced in time, the player asks for a
+# later frame instead (see min_frame_time()), and we count the frames that were skipped.
+
+import time
+
+# Weight of the newest sample in the frame latency moving average.
+_LATENCY_SMOOTHING = 0.2
+
+class PlaybackClock:
+  def __init__(self):
+    self._anchor_media_time = None
+    self._anchor_wall_time = None
+    self._frame_duration = 0.0
+    self._last_frame_time = None
+
+    # Moving average of the time from requesting a frame to receiving it, in seconds.
+    self._latency = 0.0
+
+    self.frames_shown = 0
+    self.frames_dropped = 0
+
+  # Starts the clock so that frame_time is shown at now.
+  def start(self, frame_time: float, frame_rate: float, now: float | None = None) -> None:
+    self._anchor_media_time = frame_time
+    self._anchor_wall_time = time.time() if now is None else now
+    self._frame_duration = 1.0 / frame_rate
+    self._last_frame_time = None
+    self.frames_shown = 0
+    self.frames_dropped = 0
+
+  def stop(self) -> None:
+    self._anchor_media_time = None
+    self._anchor_wall_time = None
+
+  def running(self) -> bool:
+    return self._anchor_media_time is not None
+
+  def media_time(self, now: float) -> float:
+    return self._anchor_media_time + (now - self._anchor_wall_time)
+
+  # Wall clock time at which the frame at frame_time should be shown.
+  def wall_time(self, frame_time: float) -> float:
+    return self._anchor_wall_time + (frame_time - self._anchor_media_time)
+
+  def record_latency(self, latency: float) -> None:
+    if self._latency == 0.0:
+      self._latency = latency
+    else:
+      self._latency = _LATENCY_SMOOTHING * latency + (1.0 - _LATENCY_SMOOTHING) * self._latency
+
+  def latency(self) -> float:
+    return self._latency
+
+  # Wall clock time to request the frame after the one at frame_time, so it arrives about when it's due.
+  def next_request_time(self, frame_time: float) -> float:
+    return self.wall_time(frame_time) - self._latency
+
+  # Frames before this would arrive after they are due if requested now, so they should be skipped.
+  def min_frame_time(self, now: float) -> float:
+    return self.media_time(now + self._latency)
+
+  # Counts frames skipped since the last frame shown.
+  def frame_shown(self, frame_time: float) -> None:
+    if self._last_frame_time is not None and self._frame_duration > 0.0:
+      skipped = round((frame_time - self._last_frame_time) / self._frame_duration) - 1
+      self.frames_dropped += max(0, skipped)
+    self._last_frame_time = frame_time
+    self.frames_shown += 1
@@ -1,23 +1,91 @@
 import dataclasses
 import functools
+import threading
 from typing import Any
 
 import jax
 from jax import numpy as jnp
 import numpy as np
 
-from JaxVidFlow import gyroflow, normalize, scale, utils, video_reader
+from JaxVidFlow import gyroflow, scale, utils, video_reader
 
-from config_block import ConfigDict
+import cache_dirs
+from config_dict import ConfigDict
 
-# This is the JAX part of the processing that can all be compiled (everything except the Gyroflow processing).
-@functools.partial(jax.jit, static_argnames=[
+# Stores compiled kernels on disk, so we don't have to compile them again every time we start.
+def enable_compilation_cache(cache_dir: str | None = None) -> None:
+  if cache_dir is None:
+    cache_dir = cache_dirs.cache_dir('xla')
+  jax.config.update('jax_compilation_cache_dir', cache_dir)
+  # Cache everything, including the small kernels like convert_to_display. They are cheap to store, and they are all
+  # on the critical path for the first frame.
+  jax.config.update('jax_persistent_cache_min_compile_time_secs', 0)
+  jax.config.update('jax_persistent_cache_min_entry_size_bytes', -1)
+
+# Window size for the box filter before taking channel min/max for colour normalisation, so a few noisy or hot
+# pixels don't determine the range.
+_NORMALIZE_DOWNSAMPLE_WIN = 4
+
+# Per-channel min and max of a (H, W, C) frame, taken after a box filter of downsample_win x downsample_win.
+def channel_min_max(frame: jnp.ndarray, downsample_win: int = _NORMALIZE_DOWNSAMPLE_WIN) -> tuple[jnp.ndarray, jnp.ndarray]:
+  h, w, c = frame.shape
+  h = h // downsample_win * downsample_win
+  w = w // downsample_win * downsample_win
+  blocks = frame[:h, :w].reshape(h // downsample_win, downsample_win, w // downsample_win, downsample_win, c)
+  blocks = jnp.mean(blocks, axis=(1, 3))
+  return jnp.min(blocks, axis=(0, 1)), jnp.max(blocks, axis=(0, 1))
+
+# Stretches each channel from [mins, maxs] to [0, 1], with the gain limited to max_gain.
+def normalize_with_min_max(frame: jnp.ndarray, mins: jnp.ndarray, maxs: jnp.ndarray, max_gain: float) -> jnp.ndarray:
+  gain = jnp.minimum(1.0 / jnp.maximum(maxs - mins, 1e-6), max_gain)
+  return jnp.clip((frame - mins) * gain, 0.0, 1.0)
+
+# Number of entries in the gamma lookup table. The table holds y ** gamma for y in [0, 1] (after normalisation, so the
+# error doesn't depend on the gain), and is interpolated linearly. Measured against jnp.pow, the largest error is 1.0
+# 8-bit steps at gamma 0.5 (all of it in the first interval, where the slope is unbounded), 0.03 steps at gamma 0.8 and
+# under 0.001 steps at the default gamma of 1.1.
+_GAMMA_LUT_SIZE = 4096
+
+# x ** gamma for x in [0, 1] through the lookup table, which trades the pow per value for two gathers and a lerp. This
+# is the 'lookup_table' option in the 'gamma' config block. Use `reefshader benchmark-gamma-lut` to see whether it is
+# faster on a given backend.
+def pow_lut(x: jnp.ndarray, gamma: float) -> jnp.ndarray:
+  table = jnp.pow(jnp.linspace(0.0, 1.0, _GAMMA_LUT_SIZE, dtype=jnp.float32), gamma)
+  pos = jnp.clip(x.astype(jnp.float32), 0.0, 1.0) * (_GAMMA_LUT_SIZE - 1)
+  index = jnp.minimum(pos.astype(jnp.int32), _GAMMA_LUT_SIZE - 2)
+  frac = pos - index
+  return (table[index] + (table[index + 1] - table[index]) * frac).astype(x.dtype)
+
+# Dtypes for the 'precision' option in the 'output' config block. The arithmetic in process_step1 is always float32
+# (casting before normalisation would amplify the quantisation error by the gain), and only the frames it returns are
+# stored in this dtype. With the 16-bit types, that halves the memory traffic and footprint of the intermediate frames
+# on their way to quantisation and encoding. This only applies to export without Gyroflow. Gyroflow takes float32
+# frames, and the fused preview kernel (process_for_display) never stores intermediate frames. Use `reefshader check-precision` to compare against
+# float32 on real footage.
+PRECISIONS = {
+  'float32': jnp.float32,
+  'float16': jnp.float16,
+  'bfloat16': jnp.bfloat16,
+}
+
+_STEP1_STATIC_ARGNAMES = [
     'output_for_gyroflow', 'rotation',
-    'colour_norm_enabled', 'max_gain', 'temporal_smoothing',
-    'gamma_enabled', 'gamma'])
+    'colour_norm_enabled',
+    'gamma_enabled',
+    'precision',
+    'return_ref',
+    'gamma_lut']
+
+# This is the JAX part of the processing that can all be compiled (everything except the Gyroflow processing).
+# Only structural switches are static. Continuous parameters (max_gain, temporal_smoothing, gamma) are traced, so
+# dragging a slider doesn't compile a new kernel for every value. The unprocessed (but rotated) frame is only returned
+# as ref with return_ref (for side by side), since otherwise it's a full resolution output buffer nobody uses. With
+# gamma_lut, gamma goes through pow_lut instead of jnp.pow.
+@functools.partial(jax.jit, static_argnames=_STEP1_STATIC_ARGNAMES)
 def process_step1(frame, carry, output_for_gyroflow: bool, rotation: int,
                   colour_norm_enabled: bool, max_gain: float, temporal_smoothing: float,
-                  gamma_enabled: bool, gamma: float) -> tuple[jnp.ndarray, jnp.ndarray]:
+                  gamma_enabled: bool, gamma: float, precision: str = 'float32', return_ref: bool = True,
+                  stats=None, gamma_lut: bool = False) -> tuple[jnp.ndarray, jnp.ndarray | None, Any]:
   if carry is None:
     last_frame_mins = None
     last_frame_maxs = None
@@ -38,22 +106,182 @@ def process_step1(frame, carry, output_for_gyroflow: bool, rotation: int,
   # We do the normalization in log space instead, and optionally apply gamma correction into Rec709.
   # This doesn't make much mathematical sense, but produces aesthetically pleasing results.
   # frame = lut.apply_lut(frame, 'luts/D_LOG_M_to_Rec_709_LUT_ZG_Rev1.cube')
-  if colour_norm_enabled:
-    frame, last_frame_mins, last_frame_maxs = normalize.normalize(
-        img=frame, last_frame_mins=last_frame_mins, last_frame_maxs=last_frame_maxs, max_gain=max_gain, downsample_win=4,
-        temporal_smoothing=0.0)
+  if colour_norm_enabled and stats is not None:
+    # Precomputed (and already smoothed) statistics from the analysis pass.
+    last_frame_mins, last_frame_maxs = stats
+  elif colour_norm_enabled:
+    frame_mins, frame_maxs = channel_min_max(frame)
+    if last_frame_mins is None:
+      last_frame_mins, last_frame_maxs = frame_mins, frame_maxs
+    else:
+      # Exponential moving average of the statistics, to avoid flickering. The carry stays on device, so this doesn't
+      # add a sync.
+      last_frame_mins = temporal_smoothing * last_frame_mins + (1.0 - temporal_smoothing) * frame_mins
+      last_frame_maxs = temporal_smoothing * last_frame_maxs + (1.0 - temporal_smoothing) * frame_maxs
   else:
-    last_frame_mins, last_frame_maxes = None, None
+    last_frame_mins, last_frame_maxs = None, None
+
+  if colour_norm_enabled:
+    frame = normalize_with_min_max(frame, last_frame_mins, last_frame_maxs, max_gain)
 
-  if gamma_enabled:
+  if gamma_enabled and gamma_lut:
+    frame = pow_lut(frame, gamma)
+  elif gamma_enabled:
     frame = jnp.pow(frame, gamma)
 
   frame_out = frame
   if output_for_gyroflow:
+    # Gyroflow takes float32 frames.
     frame_out = gyroflow.to_gyroflow(frame_out)
-  return frame_out, ref, (last_frame_mins, last_frame_maxs)
+  else:
+    frame_out = frame_out.astype(PRECISIONS[precision])
+    if jnp.issubdtype(ref.dtype, jnp.floating):
+      ref = ref.astype(PRECISIONS[precision])
+  return frame_out, ref if return_ref else None, (last_frame_mins, last_frame_maxs)
+
+# process_step1 with the frame and carry buffers donated, so XLA can reuse them for the outputs instead of allocating
+# new ones for every frame. The caller must not use the frame or carry passed in again, so this is only for export.
+# The preview keeps decoded frames and carries around for reprocessing.
+process_step1_donated = jax.jit(process_step1.__wrapped__, static_argnames=_STEP1_STATIC_ARGNAMES,
+                                donate_argnames=['frame', 'carry'])
+
+# Batched version of process_step1 for export. frames is (N, H, W, C), and the normalisation carry is threaded
+# through the frames in order, so results are the same as calling process_step1 N times, but we only pay for one
+# dispatch and one host to device transfer, and XLA can vectorise across frames. Gyroflow processes one frame at a
+# time, so it's not supported here.
+_STEP1_BATCHED_STATIC_ARGNAMES = [
+    'rotation',
+    'colour_norm_enabled',
+    'gamma_enabled',
+    'precision',
+    'return_ref',
+    'gamma_lut']
+
+@functools.partial(jax.jit, static_argnames=_STEP1_BATCHED_STATIC_ARGNAMES)
+def process_step1_batched(frames, carry, rotation: int,
+                          colour_norm_enabled: bool, max_gain: float, temporal_smoothing: float,
+                          gamma_enabled: bool, gamma: float, precision: str = 'float32', return_ref: bool = True,
+                          stats=None, gamma_lut: bool = False) -> tuple[jnp.ndarray, jnp.ndarray | None, Any]:
+  step1_args = dict(output_for_gyroflow=False, rotation=rotation,
+                    colour_norm_enabled=colour_norm_enabled, max_gain=max_gain, temporal_smoothing=temporal_smoothing,
+                    gamma_enabled=gamma_enabled, gamma=gamma, precision=precision, return_ref=return_ref,
+                    gamma_lut=gamma_lut)
+
+  # If provided, stats is ((N, C) mins, (N, C) maxs) from the analysis pass.
+  if carry is None:
+    # The scan carry must have the same structure going in and out, so we get the initial carry from the first frame.
+    first_stats = None if stats is None else (stats[0][0], stats[1][0])
+    _, _, carry = process_step1(frames[0], None, stats=first_stats, **step1_args)
+
+  def step(carry, frame_and_stats):
+    frame, frame_stats = frame_and_stats
+    frame_out, ref, carry = process_step1(frame, carry, stats=frame_stats, **step1_args)
+    return carry, (frame_out, ref)
+
+  carry, (frames_out, refs) = jax.lax.scan(step, carry, (frames, stats))
+  return frames_out, refs, carry
+
+# process_step1_batched with the frames and carry donated (see process_step1_donated).
+process_step1_batched_donated = jax.jit(process_step1_batched.__wrapped__,
+                                        static_argnames=_STEP1_BATCHED_STATIC_ARGNAMES,
+                                        donate_argnames=['frames', 'carry'])
+
+# Converts to uint8. If rgbx is True, the output is a contiguous (H, W, 4) array with the padding channel filled
+# with 255 (so it's also valid RGBA), which is the layout of the QVideoFrames we display. The padding is fused into
+# the quantisation, and the host only has to do a single memcpy into the frame instead of a strided copy.
+@functools.partial(jax.jit, static_argnames=['rotation', 'max_val', 'rgbx'])
+def convert_to_display(img: jnp.ndarray, rotation: int, max_val: int | float, rgbx: bool = False) -> jnp.ndarray:
+  if rotation != 0:
+      assert rotation % 90 == 0
+      times = rotation // 90
+      img = jnp.rot90(img, k=times)
+  if max_val == 1.0:
+    assert jnp.issubdtype(img.dtype, jnp.floating), f'Got {img.dtype}'
+    # Quantise in float32 even for reduced precision frames, since bfloat16 can't represent all of 0-255. This is
+    # fused into the kernel, so the float32 frame is never materialised.
+    img = (img.astype(jnp.float32) * 255).astype(jnp.uint8)
+  elif max_val == 255:
+    assert img.dtype == jnp.uint8, f'Got {img.dtype}'
+  elif max_val == 65535:
+    assert img.dtype == jnp.uint16, f'Got {img.dtype}'
+    img = jnp.right_shift(img, 8).astype(jnp.uint8)
+  else:
+    raise ValueError(f'What do we do with {jnp.dtype} and max_val={max_val}?')
+  if rgbx and img.shape[-1] == 3:
+    img = jnp.concatenate([img, jnp.full(img.shape[:-1] + (1,), 255, dtype=jnp.uint8)], axis=-1)
+  return img
+
+# Arguments for process_step1 from config, other than the frame, carry, output_for_gyroflow and rotation. The
+# continuous parameters are converted to float32 scalars, so they are always traced with the same type (and values
+# restored from settings may be strings).
+def step1_params(config: ConfigDict) -> dict[str, Any]:
+  return dict(
+    colour_norm_enabled=config['colour_norm']['enabled'],
+    max_gain=np.float32(config['colour_norm']['max_gain']),
+    temporal_smoothing=np.float32(config['colour_norm']['temporal_smoothing']),
+    gamma_enabled=config['gamma']['enabled'],
+    gamma=np.float32(config['gamma']['gamma']),
+    gamma_lut=bool(config['gamma']['lookup_table']),
+    precision=config['output']['precision'])
 
-def process_one_frame(frame: video_reader.Frame, carry, config: ConfigDict, video_path: str) -> tuple[video_reader.Frame, Any] | None:
+# step1_params for process_for_display.
+def display_params(config: ConfigDict) -> dict[str, Any]:
+  params = step1_params(config)
+  del params['precision']
+  return params
+
+# The whole preview chain (normalisation, gamma, side by side, quantisation to uint8 and RGBX padding) in one
+# executable, for when Gyroflow is not used. This way the intermediate full resolution float32 frames never
+# materialise, and there is only one dispatch and one sync per frame. This matches process_step1 followed by
+# convert_to_display in the unfused path. rotation is only for side_by_side (see rotates_pixels), and callers pass 0
+# otherwise, so rotated videos don't compile another identical kernel. Without side_by_side frames stay in their stored
+# orientation, and the preview rotates them on display, so rotated videos don't pay for a transposed copy. There is no precision option here, since the frames never leave the kernel before quantisation.
+@functools.partial(jax.jit, static_argnames=[
+    'rotation',
+    'max_val',
+    'colour_norm_enabled',
+    'gamma_enabled',
+    'gamma_lut',
+    'side_by_side'])
+def process_for_display(frame, carry, rotation: int, max_val: int | float,
+                        colour_norm_enabled: bool, max_gain: float, temporal_smoothing: float,
+                        gamma_enabled: bool, gamma: float, gamma_lut: bool,
+                        side_by_side: bool) -> tuple[jnp.ndarray, Any]:
+  frame_out, ref, carry = process_step1(
+    frame, carry, output_for_gyroflow=False, rotation=rotation,
+    colour_norm_enabled=colour_norm_enabled, max_gain=max_gain, temporal_smoothing=temporal_smoothing,
+    gamma_enabled=gamma_enabled, gamma=gamma, gamma_lut=gamma_lut, return_ref=side_by_side)
+  if side_by_side and frame_out.shape == ref.shape:
+    frame_out = utils.MergeSideBySide(frame_out, ref)
+  return convert_to_display(frame_out, rotation=0, max_val=max_val, rgbx=True), carry
+
+# Frame size for the 'scaling' config block, or None if we shouldn't scale (we never upscale). We apply this in the
+# decoder, so everything after it (normalisation, gamma, encoding) runs on the smaller frame. The target width applies
+# to the stored (unrotated) frame, which is the long edge for rotated phone footage.
+def scaled_size(width: int, height: int, config: ConfigDict) -> tuple[int, int] | None:
+  if not config['scaling']['enabled']:
+    return None
+  target_width = int(config['scaling']['width'])
+  if target_width >= width:
+    return None
+  # Keep the height even for 4:2:0 encoding.
+  target_height = max(2, round(height * target_width / width / 2) * 2)
+  return target_width, target_height
+
+def uses_gyroflow(config: ConfigDict) -> bool:
+  return bool(config['gyroflow']['enabled'] and config['gyroflow']['dll_path'])
+
+# Whether processing has to rotate the pixels even when the caller would rather leave the rotation to metadata. Side by
+# side puts the frames next to each other along the width, which is only horizontal in display orientation.
+def rotates_pixels(config: ConfigDict) -> bool:
+  return bool(config['output']['side_by_side'])
+
+# stats are optional precomputed (mins, maxs) for colour normalisation for this frame, from colour_analysis. With
+# donate, frame.data and the carry passed in may be reused for the outputs, so they must not be used again. With
+# rotate (or if rotates_pixels), the rotation is applied to the pixels and the returned frame has rotation 0. Otherwise
+# the returned frame is in the stored orientation, with the rotation left for the caller to apply as metadata.
+def process_one_frame(frame: video_reader.Frame, carry, config: ConfigDict, video_path: str, stats=None,
+                      donate: bool = False, rotate: bool = True) -> tuple[video_reader.Frame, Any] | None:
     if carry is None:
         carry = {}
 
@@ -74,21 +302,95 @@ def process_one_frame(frame: video_reader.Frame, carry, config: ConfigDict, vide
 
     using_gyroflow = 'gyroflow' in carry
 
+    side_by_side = bool(config['output']['side_by_side'])
+    # With side by side, the input frame is also the reference, so there's nothing to gain from donating it.
+    step1 = process_step1_donated if donate and not side_by_side else process_step1
     step1_carry = carry['step1_carry'] if 'step1_carry' in carry else None
-    new_frame_data, ref, step1_carry = process_step1(
-        frame.data, step1_carry, output_for_gyroflow=using_gyroflow, rotation=frame.rotation,
-        colour_norm_enabled=config['colour_norm']['enabled'], max_gain=config['colour_norm']['max_gain'], temporal_smoothing=config['colour_norm']['temporal_smoothing'],
-        gamma_enabled=config['gamma']['enabled'], gamma=config['gamma']['gamma'])
+    rotation = frame.rotation if rotate or rotates_pixels(config) else 0
+    new_frame_data, ref, step1_carry = step1(
+        frame.data, step1_carry, output_for_gyroflow=using_gyroflow, rotation=rotation, return_ref=side_by_side,
+        stats=stats, **step1_params(config))
 
     carry['step1_carry'] = step1_carry
 
     if using_gyroflow:
-        new_frame_data = carry['gyroflow'].process_frame(frame=new_frame_data, frame_time=frame.frame_time, rotation=frame.rotation, delay_one_frame=False)
+        new_frame_data = carry['gyroflow'].process_frame(frame=new_frame_data, frame_time=frame.frame_time, rotation=rotation, delay_one_frame=False)
         if new_frame_data is None:
             return None, carry
         new_frame_data = gyroflow.from_gyroflow(new_frame_data)
 
-    if config['output']['side_by_side'] and new_frame_data.shape == ref.shape:
+    if side_by_side and new_frame_data.shape == ref.shape:
         new_frame_data = utils.MergeSideBySide(new_frame_data, ref)
 
-    return dataclasses.replace(frame, data=new_frame_data), carry
+    return dataclasses.replace(frame, data=new_frame_data, rotation=frame.rotation - rotation), carry
+
+# Batched version of process_one_frame for export, when Gyroflow is not used. Returns the processed frames stacked
+# into one (N, H, W, C) array. If provided, stats are ((N, C) mins, (N, C) maxs). With donate, the carry passed in
+# must not be used again (the stacked frames are a new buffer anyways). rotate is the same as in process_one_frame.
+def process_batch(frames: list[video_reader.Frame], carry, config: ConfigDict, stats=None,
+                  donate: bool = False, rotate: bool = True) -> tuple[jnp.ndarray, Any]:
+    assert not uses_gyroflow(config)
+    if carry is None:
+        carry = {}
+
+    side_by_side = bool(config['output']['side_by_side'])
+    step1_batched = process_step1_batched_donated if donate and not side_by_side else process_step1_batched
+    step1_carry = carry['step1_carry'] if 'step1_carry' in carry else None
+    frames_data = jnp.stack([frame.data for frame in frames])
+    new_frames_data, refs, step1_carry = step1_batched(
+        frames_data, step1_carry, rotation=frames[0].rotation if rotate or rotates_pixels(config) else 0, return_ref=side_by_side, stats=stats,
+        **step1_params(config))
+
+    carry['step1_carry'] = step1_carry
+
+    if side_by_side and new_frames_data.shape == refs.shape:
+        new_frames_data = jnp.stack([utils.MergeSideBySide(new_frames_data[i], refs[i]) for i in range(len(frames))])
+
+    return new_frames_data, carry
+
+# Fused preview path (see process_for_display), when Gyroflow is not used. Returns the display-ready (H, W, 4) uint8
+# frame, in the stored orientation unless rotates_pixels.
+def process_one_frame_for_display(frame: video_reader.Frame, carry, config: ConfigDict) -> tuple[jnp.ndarray, Any]:
+    assert not uses_gyroflow(config)
+    if carry is None:
+        carry = {}
+
+    if not config['gyroflow']['enabled'] and 'gyroflow' in carry:
+        del carry['gyroflow']
+
+    step1_carry = carry['step1_carry'] if 'step1_carry' in carry else None
+    side_by_side = bool(config['output']['side_by_side'])
+    display_frame, step1_carry = process_for_display(
+        frame.data, step1_carry, rotation=frame.rotation if side_by_side else 0, max_val=frame.max_val,
+        side_by_side=side_by_side, **display_params(config))
+
+    carry['step1_carry'] = step1_carry
+    return display_frame, carry
+
+# Compiles the preview kernels for frames of the given shape, dtype and rotation, for all combinations of the enable flags (and
+# side by side), so the first frame and toggling config blocks don't stall on a compile. This mirrors what
+# VideoProcessor.request_one_frame does, without Gyroflow. Continuous parameters are traced, so their values don't
+# matter here.
+def warmup(shape: tuple[int, ...], dtype, rotation: int, max_val: int | float, config: ConfigDict) -> None:
+  params = display_params(config)
+  frame = jnp.zeros(shape, dtype=dtype)
+  convert_to_display(frame, rotation=0, max_val=max_val, rgbx=True).block_until_ready()
+  # Each carry structure compiles separately: none after a load or seek, (None, None) after a frame without colour
+  # normalisation (eg. right after it's enabled again), and the statistics after a frame with it.
+  channel_stats = jnp.zeros(shape[-1:], dtype=jnp.float32)
+  carries = [None, (None, None), (channel_stats, channel_stats)]
+  for colour_norm_enabled in (False, True):
+    for gamma_enabled in (False, True):
+      for side_by_side in (False, True):
+        params.update(colour_norm_enabled=colour_norm_enabled, gamma_enabled=gamma_enabled)
+        for step1_carry in carries:
+          display_frame, _ = process_for_display(
+            frame, step1_carry, rotation=rotation if side_by_side else 0, max_val=max_val, side_by_side=side_by_side,
+            **params)
+        display_frame.block_until_ready()
+
+def warmup_async(shape: tuple[int, ...], dtype, rotation: int, max_val: int | float,
+                 config: ConfigDict) -> threading.Thread:
+  thread = threading.Thread(target=warmup, args=(shape, dtype, rotation, max_val, config), daemon=True)
+  thread.start()
+  return thread
@@ -0,0 +1,135 @@
+# Low resolution, all-intra proxies for previewing. Long-GOP sources (eg. 10-bit HEVC from action cameras) are expensive
+# to seek in and to decode, and with a proxy where every frame is a keyframe, every seek only decodes one small frame.
+#
+# Proxies are only used for the preview. Export always reads the source file.
+#
+# Proxies keep the stored orientation and the frame times of the source, so frame indices, the colour statistics and
+# Gyroflow data of the source all line up. The source rotation is recorded in a sidecar file next to the proxy, which
+# is written last, so a proxy only counts as done once its sidecar exists.
+
+import dataclasses
+import os
+import queue
+import sys
+import threading
+from typing import Callable
+
+import numpy as np
+
+import cache_dirs
+import decoding
+import process
+import video_encoder
+
+# Width of the proxies. This is enough for the preview on most screens, and decodes quickly even in software.
+_PROXY_WIDTH = 960
+
+_PROXY_CODEC = 'h264'
+_PROXY_BITRATE_MBPS = 20
+
+_PROXY_VERSION = 1
+
+# Niceness for the transcoding thread, so proxies don't take CPU time away from the preview or exports.
+_PROXY_THREAD_NICENESS = 10
+
+@dataclasses.dataclass
+class Proxy:
+  path: str
+
+  # Rotation of the source video, which the proxy frames don't carry.
+  rotation: int
+
+# Returns the paths of the proxy video and its sidecar file.
+def _proxy_paths(path: str) -> tuple[str, str]:
+  sidecar_path = cache_dirs.sidecar_path('proxies', path, _PROXY_VERSION, 'npz')
+  return f'{os.path.splitext(sidecar_path)[0]}.mp4', sidecar_path
+
+# Returns the proxy for path, or None if we haven't made one yet.
+def load_cached(path: str) -> Proxy | None:
+  proxy_path, sidecar_path = _proxy_paths(path)
+  data = cache_dirs.load_npz(sidecar_path)
+  if data is None:
+    return None
+  return Proxy(path=proxy_path, rotation=int(data['rotation']))
+
+# Returns None if stopped through should_stop.
+def transcode(path: str, should_stop: Callable[[], bool] | None = None) -> Proxy | None:
+  proxy_path, sidecar_path = _proxy_paths(path)
+  reader, _ = decoding.open_video_reader(path)
+  width = min(_PROXY_WIDTH, reader.width())
+  # Keep the height even for 4:2:0 encoding.
+  height = max(2, round(reader.height() * width / reader.width() / 2) * 2)
+  frame_rate = reader.frame_rate()
+  reader.set_width(width)
+  reader.set_height(height)
+
+  # The encoder needs the mp4 extension to pick the container, so this can't go through cache_dirs.
+  tmp_path = f'{os.path.splitext(proxy_path)[0]}.{os.getpid()}.tmp.mp4'
+  rotation = 0
+  try:
+    with video_encoder.VideoEncoder(tmp_path, _PROXY_CODEC, _PROXY_BITRATE_MBPS, frame_rate, width, height,
+                                    intra_only=True) as encoder:
+      while True:
+        if should_stop is not None and should_stop():
+          break
+        try:
+          frame = next(reader)
+        except StopIteration:
+          break
+        rotation = frame.rotation
+        # Keep the stored orientation. The preview rotates proxy frames the same way as source frames.
+        encoder.encode(np.asarray(process.convert_to_display(frame.data, rotation=0, max_val=frame.max_val)),
+                       frame_time=frame.frame_time)
+    if should_stop is not None and should_stop():
+      return None
+    os.replace(tmp_path, proxy_path)
+  finally:
+    if os.path.exists(tmp_path):
+      os.remove(tmp_path)
+
+  cache_dirs.save_npz_atomic(sidecar_path, rotation=np.array(rotation))
+  return Proxy(path=proxy_path, rotation=rotation)
+
+# Transcodes queued files one at a time on a low priority background thread.
+class ProxyQueue:
+  def __init__(self):
+    self._queue = queue.Queue()
+    self._queued = set()
+    self._lock = threading.Lock()
+    self._stop_event = threading.Event()
+    self._thread = None
+
+  # Queues path for transcoding, unless it already has a proxy or is already queued.
+  def add(self, path: str) -> None:
+    with self._lock:
+      if path in self._queued:
+        return
+      self._queued.add(path)
+      if self._thread is None:
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    self._queue.put(path)
+
+  def stop(self) -> None:
+    self._stop_event.set()
+    self._queue.put(None)
+    if self._thread is not None:
+      self._thread.join()
+
+  def _run(self) -> None:
+    if sys.platform == 'linux':
+      # On Linux, this only applies to this thread.
+      try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), _PROXY_THREAD_NICENESS)
+      except OSError:
+        pass
+    while not self._stop_event.is_set():
+      path = self._queue.get()
+      if path is None:
+        return
+      try:
+        if load_cached(path) is not None:
+          continue
+        transcode(path, should_stop=self._stop_event.is_set)
+      except Exception as e:
+        print(f'Failed to make proxy for {path}: {e}')
@@ -0,0 +1,230 @@
+"""Command line interface for batch rendering without the GUI.
+
+Example:
+  python -m reefshader render --config cfg.json in/*.mp4 -o out/
+  python -m reefshader check-precision --precision bfloat16 in/clip.mp4
+  python -m reefshader benchmark-gamma-lut --gamma 0.5
+  python -m reefshader check-rotation
+
+The config file uses the same block/key structure as the GUI config blocks, eg.
+  {"gamma": {"enabled": true, "gamma": 1.2}, "encode": {"codec": "hevc", "bitrate": 40}}
+Blocks and keys that are not specified use the GUI defaults.
+"""
+
+# This module must not import PySide6 (directly or indirectly), so it can run on headless machines.
+
+import argparse
+import glob
+import json
+import os
+import sys
+import tempfile
+import time
+
+import jax
+import numpy as np
+
+from JaxVidFlow import video_reader
+
+from config_dict import ConfigDict
+import decoding
+import process
+import render
+import render_scheduler
+import video_encoder
+
+# These should match the defaults in the GUI config block specs.
+_DEFAULT_CONFIG = {
+  'scaling': {'enabled': True, 'width': 1920},
+  'gamma': {'enabled': True, 'gamma': 1.1, 'lookup_table': False},
+  'colour_norm': {'enabled': True, 'max_gain': 10.0, 'temporal_smoothing': 0.95, 'two_pass': True},
+  'gyroflow': {'enabled': True, 'underwater': True, 'dll_path': ''},
+  'output': {'side_by_side': False, 'rotate_with_metadata': False, 'precision': 'float32'},
+  'encode': {'codec': 'h264', 'bitrate': 20},
+}
+
+def load_config(path: str | None) -> ConfigDict:
+  config = json.loads(json.dumps(_DEFAULT_CONFIG))
+  if path is not None:
+    with open(path, 'r') as f:
+      user_config = json.load(f)
+    for block_name, block in user_config.items():
+      if block_name not in config:
+        raise ValueError(f'Unknown config block: {block_name}')
+      config[block_name].update(block)
+  return ConfigDict.from_dict(config)
+
+def _expand_inputs(inputs: list[str]) -> list[str]:
+  # Shells on Windows don't expand globs for us.
+  paths = []
+  for pattern in inputs:
+    matches = sorted(glob.glob(pattern))
+    if not matches and os.path.isfile(pattern):
+      matches = [pattern]
+    if not matches:
+      raise FileNotFoundError(f'No input files match {pattern}')
+    paths.extend(matches)
+  return paths
+
+def _render_command(args) -> int:
+  config = load_config(args.config)
+  paths = _expand_inputs(args.inputs)
+  output_dir = os.path.abspath(args.output) if args.output is not None else 'processed/'
+  jobs = [render_scheduler.RenderJob(input_path=path, output_path=render.output_path_for(path, output_dir))
+          for path in paths]
+  num_workers = args.jobs if args.jobs is not None else render_scheduler.default_num_workers(len(jobs))
+  print(f'Rendering {len(jobs)} file(s) with {num_workers} worker(s)')
+
+  def job_progress(input_path, frames_done, num_frames, fps):
+    print(f'{input_path}: {frames_done}/{num_frames} frames ({fps:.1f} FPS)', flush=True)
+
+  def job_done(result):
+    if result.completed:
+      print(f'{result.input_path}: Done', flush=True)
+    else:
+      print(f'{result.input_path}: Failed: {result.error}', flush=True)
+
+  results = render_scheduler.render_files(jobs, config, num_workers=num_workers, progress_callback=job_progress,
+                                          done_callback=job_done, batch_size=args.batch_size)
+  return 0 if all(result.completed for result in results) else 1
+
+# Processes the first frames of a file in float32 and in a reduced precision, and compares the 8-bit outputs. Gyroflow
+# is left out, since it always runs in float32.
+def _check_precision_command(args) -> int:
+  config = load_config(args.config).to_dict()
+  config['gyroflow']['enabled'] = False
+  config['output']['side_by_side'] = False
+  config['output']['precision'] = 'float32'
+  reference_config = ConfigDict.from_dict(config)
+  config['output']['precision'] = args.precision
+  test_config = ConfigDict.from_dict(config)
+
+  reader, _ = decoding.open_video_reader(args.input)
+  size = process.scaled_size(reader.width(), reader.height(), reference_config)
+  if size is not None:
+    reader.set_width(size[0])
+    reader.set_height(size[1])
+
+  reference_carry = None
+  test_carry = None
+  max_diff = 0
+  sum_diff = 0
+  num_values = 0
+  num_frames = 0
+  for _ in range(args.frames):
+    try:
+      frame = next(reader)
+    except StopIteration:
+      break
+    reference_frame, reference_carry = process.process_one_frame(frame, reference_carry, reference_config, args.input)
+    test_frame, test_carry = process.process_one_frame(frame, test_carry, test_config, args.input)
+    # process_one_frame already rotated the frames.
+    reference_out = np.asarray(process.convert_to_display(reference_frame.data, rotation=0, max_val=frame.max_val))
+    test_out = np.asarray(process.convert_to_display(test_frame.data, rotation=0, max_val=frame.max_val))
+    diff = np.abs(reference_out.astype(np.int32) - test_out.astype(np.int32))
+    max_diff = max(max_diff, int(diff.max()))
+    sum_diff += int(diff.sum())
+    num_values += diff.size
+    num_frames += 1
+
+  if num_frames == 0:
+    print(f'{args.input}: No frames')
+    return 1
+  passed = max_diff <= args.tolerance
+  print(f'{args.input}: {args.precision} vs float32 over {num_frames} frames: max difference {max_diff}, '
+        f'mean difference {sum_diff / num_values:.4f} (8-bit steps, tolerance {args.tolerance}): '
+        f'{"PASS" if passed else "FAIL"}')
+  return 0 if passed else 1
+
+# Times process_step1 on a random frame with gamma through jnp.pow and through the lookup table (process.pow_lut), and
+# compares the 8-bit outputs. The table is only worth making the default on backends where it's faster.
+def _benchmark_gamma_lut_command(args) -> int:
+  config = load_config(args.config)
+  params = process.step1_params(config)
+  params.update(gamma_enabled=True, gamma=np.float32(args.gamma))
+  del params['gamma_lut']
+  frame = jax.device_put(np.random.default_rng(0).random((args.height, args.width, 3), dtype=np.float32))
+
+  outputs = {}
+  times = {}
+  for gamma_lut in (False, True):
+    def run():
+      frame_out, _, _ = process.process_step1(frame, None, output_for_gyroflow=False, rotation=0, return_ref=False,
+                                              gamma_lut=gamma_lut, **params)
+      return frame_out.block_until_ready()
+    # The first call compiles.
+    outputs[gamma_lut] = np.asarray(process.convert_to_display(run(), rotation=0, max_val=1.0))
+    start_time = time.time()
+    for _ in range(args.iterations):
+      run()
+    times[gamma_lut] = (time.time() - start_time) / args.iterations
+
+  diff = np.abs(outputs[False].astype(np.int32) - outputs[True].astype(np.int32))
+  print(f'{jax.default_backend()}, {args.width}x{args.height}, gamma {args.gamma}: '
+        f'pow {times[False] * 1000:.2f} ms, table {times[True] * 1000:.2f} ms per frame, '
+        f'max difference {int(diff.max())} (8-bit steps)')
+  return 0
+
+# Encodes a small clip with each rotation, and checks that a reader sees the same rotation, which is what
+# rotate_with_metadata exports rely on.
+def _check_rotation_command(args) -> int:
+  passed = True
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    for rotation in (0, 90, 180, 270):
+      path = os.path.join(tmp_dir, f'rotation_{rotation}.mp4')
+      with video_encoder.VideoEncoder(path, args.codec, bitrate_mbps=1, frame_rate=30, width=64, height=32,
+                                      rotation=rotation) as encoder:
+        for _ in range(3):
+          encoder.encode(np.zeros((32, 64, 3), dtype=np.uint8))
+      reader = video_reader.VideoReader(filename=path)
+      read_rotation = next(reader).rotation % 360
+      reader = None
+      ok = read_rotation == rotation
+      passed = passed and ok
+      print(f'Rotation {rotation}: read back {read_rotation}: {"PASS" if ok else "FAIL"}')
+  return 0 if passed else 1
+
+def main(argv: list[str] | None = None) -> int:
+  parser = argparse.ArgumentParser(prog='reefshader', description='Underwater video correction')
+  subparsers = parser.add_subparsers(dest='command', required=True)
+
+  render_parser = subparsers.add_parser('render', help='Process and encode video files')
+  render_parser.add_argument('inputs', nargs='+', help='Input video files (globs are allowed)')
+  render_parser.add_argument('--config', help='JSON config file with the same structure as the GUI config blocks')
+  render_parser.add_argument('-o', '--output', help='Output directory (default: processed/ next to each input file)')
+  render_parser.add_argument('-j', '--jobs', type=int, help='Number of files to render in parallel')
+  render_parser.add_argument('--batch-size', type=int, default=render.DEFAULT_BATCH_SIZE,
+                             help='Number of frames to process per JAX call (not used with Gyroflow)')
+  render_parser.set_defaults(func=_render_command)
+
+  check_parser = subparsers.add_parser('check-precision',
+                                       help='Compare reduced precision processing against float32 on a file')
+  check_parser.add_argument('input', help='Input video file')
+  check_parser.add_argument('--config', help='JSON config file with the same structure as the GUI config blocks')
+  check_parser.add_argument('--precision', choices=[precision for precision in process.PRECISIONS if precision != 'float32'],
+                            default='bfloat16', help='Precision to compare against float32')
+  check_parser.add_argument('--frames', type=int, default=30, help='Number of frames to compare')
+  check_parser.add_argument('--tolerance', type=int, default=2,
+                            help='Largest allowed difference in any output value, in 8-bit steps')
+  check_parser.set_defaults(func=_check_precision_command)
+
+  benchmark_parser = subparsers.add_parser('benchmark-gamma-lut',
+                                           help='Time gamma through pow and through a lookup table on this machine')
+  benchmark_parser.add_argument('--config', help='JSON config file with the same structure as the GUI config blocks')
+  benchmark_parser.add_argument('--gamma', type=float, default=1.1, help='Gamma to benchmark')
+  benchmark_parser.add_argument('--width', type=int, default=1920, help='Frame width')
+  benchmark_parser.add_argument('--height', type=int, default=1080, help='Frame height')
+  benchmark_parser.add_argument('--iterations', type=int, default=50, help='Number of timed frames')
+  benchmark_parser.set_defaults(func=_benchmark_gamma_lut_command)
+
+  rotation_parser = subparsers.add_parser('check-rotation',
+                                          help='Check that rotation metadata in exported files is read back correctly')
+  rotation_parser.add_argument('--codec', default='h264', help='Codec to encode the test clips with')
+  rotation_parser.set_defaults(func=_check_rotation_command)
+
+  args = parser.parse_args(argv)
+  process.enable_compilation_cache()
+  return args.func(args)
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,140 @@
+import os
+import time
+from typing import Callable
+
+import numpy as np
+
+import colour_analysis
+import decoding
+import pipeline
+import process
+import video_encoder
+
+_OUTPUT_EXTENSION = 'mp4'
+
+# Number of frames that can be waiting between each pair of pipeline stages (decode -> process -> encode). Frames
+# are full resolution, so we keep this small.
+_QUEUE_SIZE = 2
+
+# Number of frames processed per JAX call when Gyroflow is not used.
+DEFAULT_BATCH_SIZE = 8
+
+# Called with (frames done, total frames, frames per second).
+ProgressCallback = Callable[[int, int, float], None]
+
+def output_path_for(input_path: str, output_dir: str) -> str:
+  # output_dir is relative to the directory the input file is in (unless it's an absolute path).
+  base_name = os.path.splitext(os.path.basename(input_path))[0]
+  return os.path.join(os.path.dirname(input_path), output_dir, f'{base_name}.{_OUTPUT_EXTENSION}')
+
+# Renders one file with the full processing pipeline. Returns False if stopped through should_stop, in which case
+# the partial output is removed.
+def render_file(input_path: str, output_path: str, config, progress_callback: ProgressCallback | None = None,
+                should_stop: Callable[[], bool] | None = None, batch_size: int = DEFAULT_BATCH_SIZE) -> bool:
+  colour_stats = None
+  colour_norm_config = config['colour_norm']
+  if colour_norm_config['enabled'] and colour_norm_config['two_pass']:
+    colour_stats = colour_analysis.load_or_analyze(input_path, config, should_stop=should_stop)
+    if colour_stats is None:
+      return False
+    if len(colour_stats.frame_times) == 0:
+      colour_stats = None
+    else:
+      colour_stats = colour_stats.smoothed(float(colour_norm_config['temporal_smoothing']))
+
+  reader, decoder_name = decoding.open_video_reader(input_path)
+  video_info = decoding.get_video_info(reader, decoder_name)
+  encode_config = config['encode']
+
+  # Downscale in the decoder, so all the processing runs at the output size.
+  output_size = process.scaled_size(reader.width(), reader.height(), config)
+  if output_size is not None:
+    reader.set_width(output_size[0])
+    reader.set_height(output_size[1])
+
+  carry = None
+
+  # With rotate_with_metadata, frames stay in their stored orientation and the output is tagged with the rotation for
+  # players to apply, instead of making a rotated copy of every frame. Side by side always rotates the pixels.
+  rotate = not config['output']['rotate_with_metadata'] or process.rotates_pixels(config)
+
+  # Pipeline items are (frames, number of valid frames, rotation), where frames is a (N, H, W, C) uint8 array, and
+  # rotation is what's left for the player to apply. The processing stage only dispatches the JAX work, and the result
+  # is synced when the encode stage converts it to numpy.
+  if process.uses_gyroflow(config) or batch_size <= 1:
+    def read_frames():
+      return next(reader)
+
+    def process_frames(frame):
+      nonlocal carry
+      stats = colour_stats.lookup(frame.frame_time) if colour_stats is not None else None
+      # Frames and carries aren't used again after processing, so their buffers can be reused.
+      processed, carry = process.process_one_frame(frame, carry, config, input_path, stats=stats, donate=True,
+                                                   rotate=rotate)
+      if processed is None:
+        return None
+      return (process.convert_to_display(processed.data[None], rotation=0, max_val=processed.max_val), 1,
+              processed.rotation)
+  else:
+    def read_frames():
+      batch = []
+      for _ in range(batch_size):
+        try:
+          batch.append(next(reader))
+        except StopIteration:
+          break
+      if not batch:
+        raise StopIteration()
+      return batch
+
+    def process_frames(batch):
+      nonlocal carry
+      num_valid = len(batch)
+      # Pad the last batch to the full size, so we don't compile again for the odd size.
+      batch = batch + [batch[-1]] * (batch_size - num_valid)
+      stats = None
+      if colour_stats is not None:
+        batch_stats = [colour_stats.lookup(frame.frame_time) for frame in batch]
+        stats = (np.stack([mins for mins, _ in batch_stats]), np.stack([maxs for _, maxs in batch_stats]))
+      processed, carry = process.process_batch(batch, carry, config, stats=stats, donate=True, rotate=rotate)
+      return (process.convert_to_display(processed, rotation=0, max_val=batch[0].max_val), num_valid,
+              0 if rotate else batch[0].rotation)
+
+  frames = pipeline.Pipeline(source=read_frames, stages=[process_frames], queue_size=_QUEUE_SIZE)
+
+  encoder = None
+  frames_done = 0
+  start_time = time.time()
+  completed = False
+  try:
+    while True:
+      if should_stop is not None and should_stop():
+        break
+
+      try:
+        data, num_valid, rotation = next(frames)
+        data = np.asarray(data)
+      except StopIteration:
+        completed = True
+        break
+
+      if encoder is None:
+        encoder = video_encoder.VideoEncoder(
+          output_path, codec=encode_config['codec'], bitrate_mbps=encode_config['bitrate'],
+          frame_rate=video_info.frame_rate, width=data.shape[2], height=data.shape[1], rotation=rotation)
+      for frame_idx in range(num_valid):
+        encoder.encode(data[frame_idx])
+
+      frames_done += num_valid
+      if progress_callback is not None:
+        fps = frames_done / max(time.time() - start_time, 0.0001)
+        progress_callback(frames_done, video_info.num_frames, fps)
+  finally:
+    frames.close()
+    if encoder is not None:
+      encoder.close()
+    reader = None
+    if not completed and os.path.exists(output_path):
+      os.remove(output_path)
+
+  return completed
@@ -0,0 +1,172 @@
+# Renders multiple files in parallel on a process pool. Each worker process owns its own video reader and JAX state.
+# This module must not import PySide6, because it's also used by the command line interface, and worker processes
+# re-import it.
+
+import concurrent.futures
+import dataclasses
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from typing import Callable
+
+from JaxVidFlow import video_reader
+
+import decoding
+import process
+import render
+
+# How often workers report progress back, and how often we check for it, in seconds.
+_PROGRESS_INTERVAL = 0.5
+
+@dataclasses.dataclass
+class RenderJob:
+  input_path: str
+  output_path: str
+
+  # Estimated amount of work (num frames x resolution). Used to start large files first.
+  cost: int = 0
+
+@dataclasses.dataclass
+class RenderResult:
+  input_path: str
+  completed: bool
+  error: Exception | None = None
+
+# Called with (input path, frames done, total frames, frames per second).
+JobProgressCallback = Callable[[str, int, int, float], None]
+
+# Called with the result of each job as it finishes.
+JobDoneCallback = Callable[[RenderResult], None]
+
+def estimate_cost(path: str) -> int:
+  # We only need metadata here, so we use a software reader to avoid taking up hardware decoder contexts.
+  reader = video_reader.VideoReader(filename=path)
+  video_info = decoding.get_video_info(reader, 'Software')
+  return video_info.num_frames * video_info.width * video_info.height
+
+def default_num_workers(num_jobs: int) -> int:
+  # XLA already uses multiple threads for each frame, so we don't need a worker per core, and each worker
+  # holds a few full resolution frames in memory.
+  return max(1, min(num_jobs, (os.cpu_count() or 1) // 4))
+
+# Returns why job can't be rendered, or None. Writing to the input (eg. an empty output dir with an .mp4 input) would
+# truncate the source while we are reading it, and two jobs writing the same output (eg. a.mov and a.mp4) would
+# clobber each other's output.
+def _output_path_error(job: RenderJob, output_paths: set[str]) -> str | None:
+  output_path = os.path.normcase(os.path.abspath(job.output_path))
+  if output_path == os.path.normcase(os.path.abspath(job.input_path)):
+    return f'Output path is the input file: {job.output_path}'
+  if (os.path.exists(job.input_path) and os.path.exists(job.output_path) and
+      os.path.samefile(job.input_path, job.output_path)):
+    return f'Output path is the input file: {job.output_path}'
+  if output_path in output_paths:
+    return f'Another file is also rendering to {job.output_path}'
+  return None
+
+def _render_job(job: RenderJob, config, batch_size: int, progress_queue, stop_event) -> bool:
+  last_progress_time = 0.0
+
+  def report_progress(frames_done, num_frames, fps):
+    nonlocal last_progress_time
+    now = time.time()
+    if now - last_progress_time >= _PROGRESS_INTERVAL or frames_done == num_frames:
+      last_progress_time = now
+      progress_queue.put((job.input_path, frames_done, num_frames, fps))
+
+  return render.render_file(job.input_path, job.output_path, config, progress_callback=report_progress,
+                            should_stop=stop_event.is_set, batch_size=batch_size)
+
+# Stands in for the progress queue when rendering in this process, so progress is reported as it happens rather than
+# when the file is done.
+class _CallbackQueue:
+  def __init__(self, progress_callback: JobProgressCallback | None):
+    self._progress_callback = progress_callback
+
+  def put(self, update) -> None:
+    if self._progress_callback is not None:
+      self._progress_callback(*update)
+
+def _drain_progress(progress_queue, progress_callback: JobProgressCallback | None) -> None:
+  while True:
+    try:
+      update = progress_queue.get_nowait()
+    except queue.Empty:
+      return
+    if progress_callback is not None:
+      progress_callback(*update)
+
+def render_files(jobs: list[RenderJob], config, num_workers: int,
+                 progress_callback: JobProgressCallback | None = None, done_callback: JobDoneCallback | None = None,
+                 stop_event: threading.Event | None = None,
+                 batch_size: int = render.DEFAULT_BATCH_SIZE) -> list[RenderResult]:
+  results = []
+
+  def finish(result: RenderResult) -> None:
+    results.append(result)
+    if done_callback is not None:
+      done_callback(result)
+
+  valid_jobs = []
+  output_paths = set()
+  for job in jobs:
+    error = _output_path_error(job, output_paths)
+    if error is not None:
+      finish(RenderResult(input_path=job.input_path, completed=False, error=ValueError(error)))
+      continue
+    output_paths.add(os.path.normcase(os.path.abspath(job.output_path)))
+    valid_jobs.append(job)
+  jobs = valid_jobs
+
+  for job in jobs:
+    if job.cost == 0:
+      try:
+        job.cost = estimate_cost(job.input_path)
+      except Exception:
+        # Unreadable files will fail in the worker, and be reported there.
+        pass
+
+  # Longest jobs first, so we don't end up waiting for one large file at the end with the other workers idle.
+  jobs = sorted(jobs, key=lambda job: job.cost, reverse=True)
+
+  if num_workers <= 1:
+    # No need to pay for starting worker processes.
+    local_queue = _CallbackQueue(progress_callback)
+    local_stop_event = stop_event if stop_event is not None else threading.Event()
+    for job in jobs:
+      if local_stop_event.is_set():
+        finish(RenderResult(input_path=job.input_path, completed=False))
+        continue
+      try:
+        completed = _render_job(job, config, batch_size, local_queue, local_stop_event)
+        finish(RenderResult(input_path=job.input_path, completed=completed))
+      except Exception as e:
+        finish(RenderResult(input_path=job.input_path, completed=False, error=e))
+    return results
+
+  # JAX and hardware decoders are not fork-safe.
+  mp_context = multiprocessing.get_context('spawn')
+  with mp_context.Manager() as manager:
+    progress_queue = manager.Queue()
+    worker_stop_event = manager.Event()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers, mp_context=mp_context,
+                                                initializer=process.enable_compilation_cache) as executor:
+      futures = {executor.submit(_render_job, job, config, batch_size, progress_queue, worker_stop_event): job for job in jobs}
+      pending = set(futures.keys())
+      while pending:
+        done, pending = concurrent.futures.wait(pending, timeout=_PROGRESS_INTERVAL)
+        if stop_event is not None and stop_event.is_set() and not worker_stop_event.is_set():
+          worker_stop_event.set()
+          for future in pending:
+            future.cancel()
+        _drain_progress(progress_queue, progress_callback)
+        for future in done:
+          job = futures[future]
+          if future.cancelled():
+            finish(RenderResult(input_path=job.input_path, completed=False))
+          elif future.exception() is not None:
+            finish(RenderResult(input_path=job.input_path, completed=False, error=future.exception()))
+          else:
+            finish(RenderResult(input_path=job.input_path, completed=future.result()))
+  return results
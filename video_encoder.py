@@ -0,0 +1,139 @@
+import av
+import fractions
+import os
+import struct
+
+import numpy as np
+
+# Encoders to try for each codec in the 'encode' config block, in order of preference. We only use
+# software encoders for now since they are available everywhere and produce consistent quality.
+_ENCODERS = {
+  'h264': ['libx264', 'h264'],
+  'hevc': ['libx265', 'hevc'],
+  'av1': ['libsvtav1', 'libaom-av1', 'av1'],
+}
+
+def find_encoder(codec: str) -> str:
+  for encoder_name in _ENCODERS.get(codec, [codec]):
+    try:
+      av.codec.Codec(encoder_name, 'w')
+      return encoder_name
+    except Exception:
+      continue
+  raise ValueError(f'No encoder available for {codec}')
+
+# Display matrices (a, b, c, d, tx, ty) for each counter-clockwise rotation, as FFmpeg's mov muxer used to write them
+# for the legacy 'rotate' tag. Newer muxers ignore that tag, and PyAV can't attach display matrix side data to a
+# stream, so we write the matrix into the track header ourselves after muxing. The translation is in pixels.
+def _display_matrix(rotation: int, width: int, height: int) -> tuple[int, ...]:
+  return {
+    90: (0, -1, 1, 0, 0, width),
+    180: (-1, 0, 0, -1, width, height),
+    270: (0, 1, -1, 0, height, 0),
+  }[rotation % 360]
+
+# Iterates over the ISO BMFF boxes between start and end in f, as (type, payload start, end).
+def _boxes(f, start: int, end: int):
+  offset = start
+  while offset + 8 <= end:
+    f.seek(offset)
+    size, box_type = struct.unpack('>I4s', f.read(8))
+    header_size = 8
+    if size == 1:
+      size = struct.unpack('>Q', f.read(8))[0]
+      header_size = 16
+    elif size == 0:
+      size = end - offset
+    yield box_type, offset + header_size, offset + size
+    offset += size
+
+# Returns the file offset of the matrix in the track header of the video track.
+def _video_track_matrix_offset(f, file_size: int) -> int:
+  for moov_type, moov_start, moov_end in _boxes(f, 0, file_size):
+    if moov_type != b'moov':
+      continue
+    for trak_type, trak_start, trak_end in _boxes(f, moov_start, moov_end):
+      if trak_type != b'trak':
+        continue
+      tkhd_start = None
+      is_video = False
+      for box_type, box_start, box_end in _boxes(f, trak_start, trak_end):
+        if box_type == b'tkhd':
+          tkhd_start = box_start
+        elif box_type == b'mdia':
+          for mdia_type, mdia_start, _ in _boxes(f, box_start, box_end):
+            if mdia_type == b'hdlr':
+              # After version/flags and pre_defined.
+              f.seek(mdia_start + 8)
+              is_video = f.read(4) == b'vide'
+      if is_video and tkhd_start is not None:
+        f.seek(tkhd_start)
+        version = f.read(1)[0]
+        # Version/flags, times, track ID and duration (64-bit times and duration in version 1), then reserved, layer,
+        # alternate group, volume and reserved.
+        return tkhd_start + (4 + 32 if version == 1 else 4 + 20) + 16
+  raise ValueError('No video track found')
+
+def write_display_matrix(path: str, rotation: int, width: int, height: int) -> None:
+  a, b, c, d, tx, ty = _display_matrix(rotation, width, height)
+  # a, b, c, d, tx and ty are 16.16 fixed point, u, v and w are 2.30.
+  matrix = struct.pack('>9i', a << 16, b << 16, 0, c << 16, d << 16, 0, tx << 16, ty << 16, 1 << 30)
+  with open(path, 'r+b') as f:
+    f.seek(0, os.SEEK_END)
+    offset = _video_track_matrix_offset(f, f.tell())
+    f.seek(offset)
+    f.write(matrix)
+
+class VideoEncoder:
+  # With intra_only, every frame is a keyframe, so any frame can be decoded without decoding others first. rotation is
+  # the counter-clockwise rotation for players to display the video with (as in the frames from JaxVidFlow), for frames
+  # encoded in their stored orientation. It's written as the display matrix of the track, which needs an mp4 or mov
+  # container.
+  def __init__(self, path: str, codec: str, bitrate_mbps: float, frame_rate: float, width: int, height: int,
+               intra_only: bool = False, rotation: int = 0):
+    if rotation % 360 != 0 and os.path.splitext(path)[1].lower() not in ('.mp4', '.mov'):
+      raise ValueError(f'Rotation metadata is only supported in mp4 and mov files, not {path}')
+    self._path = path
+    self._rotation = rotation % 360
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    # yuv420p requires even dimensions, so we drop the last row/column if necessary.
+    self._width = width - width % 2
+    self._height = height - height % 2
+    self._container = av.open(path, mode='w')
+    rate = fractions.Fraction(frame_rate).limit_denominator(100000)
+    self._stream = self._container.add_stream(find_encoder(codec), rate=rate)
+    self._stream.width = self._width
+    self._stream.height = self._height
+    self._stream.pix_fmt = 'yuv420p'
+    self._stream.bit_rate = int(bitrate_mbps * 1000000)
+    if intra_only:
+      self._stream.codec_context.gop_size = 1
+
+  # frame is a (height, width, 3) uint8 RGB array. If frame_time (in seconds) is given, it's used as the presentation
+  # time, otherwise frames are assumed to be at a constant frame rate.
+  def encode(self, frame: np.ndarray, frame_time: float | None = None) -> None:
+    frame = np.ascontiguousarray(frame[:self._height, :self._width, :3])
+    av_frame = av.VideoFrame.from_ndarray(frame, format='rgb24')
+    if frame_time is not None:
+      time_base = self._stream.codec_context.time_base
+      av_frame.pts = round(frame_time / time_base)
+      av_frame.time_base = time_base
+    for packet in self._stream.encode(av_frame):
+      self._container.mux(packet)
+
+  def close(self) -> None:
+    if self._container is None:
+      return
+    # Flush the encoder.
+    for packet in self._stream.encode():
+      self._container.mux(packet)
+    self._container.close()
+    self._container = None
+    if self._rotation != 0:
+      write_display_matrix(self._path, self._rotation, self._width, self._height)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
@@ -1,9 +1,9 @@
-import av
+import collections
 import dataclasses
-import functools
 import gc
-import queue
+import threading
 import time
+from typing import Any
 
 import jax
 from jax import numpy as jnp
@@ -12,17 +12,67 @@ import numpy as np
 from JaxVidFlow import scale, video_reader
 from PySide6 import QtCore, QtMultimedia
 
+import decoding
+from decoding import VideoInfo
+import frame_cache
+import keyframe_index
 import np_qt_adapter
+import pipeline
 import process
-
+import proxy_transcoder
+
+# Number of frames to decode ahead during playback.
+_DECODE_AHEAD = 3
+
+# Until we have the keyframe index, we don't know where the keyframes are, so we decode forward instead of seeking for
+# gaps up to this long (in seconds). A seek decodes from the previous keyframe anyways, which for long-GOP footage is
+# usually further back than this.
+_MAX_DECODE_FORWARD_WITHOUT_INDEX = 1.0
+
+# Memory budget for decoded and processed frames kept around for scrubbing and config changes.
+_FRAME_CACHE_BUDGET_BYTES = 1024 * 1024 * 1024
+
+# Maximum number of QVideoFrames we have sent to the GUI that can still be in use: up to two queued or waiting on a
+# timer to be shown (the GUI only asks for the next frame about when the current one is due, and drops frames from
+# before a seek), the one shown by the sink, and the one before it, which the renderer may still be drawing.
+_MAX_QT_FRAMES_IN_FLIGHT = 4
+
+# Maximum number of frames, and memory budget for them, to process ahead during playback.
+_PREFETCH_FRAMES = 8
+_PREFETCH_BUDGET_BYTES = 256 * 1024 * 1024
+
+# Identifies a config for the processed frame cache.
+def _config_key(configs) -> tuple:
+  # We go through items() so this doesn't count as using the fields.
+  return tuple((block_name, tuple(sorted(block.items()))) for block_name, block in sorted(configs.items()))
+
+# Preview decode widths. Every new frame shape is a new XLA compile, so instead of decoding at exactly the size of the
+# preview widget, we decode at the next larger of these and let Qt scale the rest of the way. This way resizing the
+# window doesn't trigger a compile for every pixel.
+_PREVIEW_WIDTH_BUCKETS = [320, 480, 640, 960, 1280, 1600, 1920, 2560, 3840, 5120, 7680]
+
+# Snaps a decode size to the smallest bucket at least as wide, keeping the aspect ratio of the video.
+def bucket_size(width: int, native_width: int, native_height: int) -> tuple[int, int]:
+  bucket_width = next((bucket for bucket in _PREVIEW_WIDTH_BUCKETS if bucket >= width), native_width)
+  if bucket_width >= native_width:
+    return native_width, native_height
+  return bucket_width, max(2, round(native_height * bucket_width / native_width / 2) * 2)
+
+# A frame processed ahead during playback.
 @dataclasses.dataclass
-class VideoInfo:
-  width: int
-  height: int
-  frame_rate: float
-  duration: float
-  num_frames: int
-  decoder_name: str
+class _PrefetchedFrame:
+  index: int
+  decoded: video_reader.Frame
+  display_frame: np.ndarray
+
+  # Normalisation carry from before this frame was processed.
+  step1_carry: Any
+
+  # Time it took to decode and process this frame, in seconds.
+  processing_time: float
+
+  def size_bytes(self) -> int:
+    return self.decoded.data.nbytes + self.display_frame.nbytes
 
 def display_w_h(old_width: int, old_height: int, width: int, height: int, rotation: int = 0) -> tuple[int, int]:
   if rotation in (90, -90, 270, -270):
@@ -35,78 +85,104 @@ def display_w_h(old_width: int, old_height: int, width: int, height: int, rotati
   assert (new_width == width and new_height <= height) or (new_width <= width and new_height == height)
   return new_width, new_height
 
-@functools.partial(jax.jit, static_argnames=['rotation', 'max_val'])
-def convert_to_display(img: jnp.ndarray, rotation: int, max_val: int | float) -> jnp.ndarray:
-  if rotation != 0:
-      assert rotation % 90 == 0
-      times = rotation // 90
-      img = jnp.rot90(img, k=times)
-  if max_val == 1.0:
-    assert img.dtype == jnp.float32, f'Got {img.dtype}'
-    return (img * 255).astype(jnp.uint8)
-  elif max_val == 255:
-    assert img.dtype == jnp.uint8, f'Got {img.dtype}'
-    return img
-  elif max_val == 65535:
-    assert img.dtype == jnp.uint16, f'Got {img.dtype}'
-    return jnp.right_shift(img, 8).astype(jnp.uint8)
-  else:
-    raise ValueError(f'What do we do with {jnp.dtype} and max_val={max_val}?')
-
-@functools.cache
-def guess_hardware_decoders() -> list[tuple[str, str]]:
-  # We create a list of everything by preference first, then filter by what's available.
-  candidates = [
-    # On modern Macs all accelerated decodes goes through VideoToolbox.
-    ('videotoolbox', 'Apple VideoToolbox'),
-
-    # On Windows we have both vendor-specific APIs and D3D11/12 VA. Vendor-specific APIs may
-    # be faster, but let's prefer D3D11/12 VA for now because it should support everything on
-    # Windows, and this way we don't have to rely on vendor-specific APIs failing gracefully
-    # so we can fallback. In the future if we know some APIs do fail gracefully, we can move
-    # them up above these.
-    ('d3d12va', 'Direct3D 12 Video Acceleration'),
-    ('d3d11va', 'Direct3D 11 Video Acceleration'),
-
-    # On Linux there's VA-API that's supported by Intel and AMD, and cuda for NVIDIA. Hopefully
-    # VA-API does fail gracefully, so we put that first, and then the vendor-specific APIs.
-    ('vaapi', 'Video Acceleration API'),
-
-    ('cuda', 'NVIDIA NVDEC'),
-    ('qsv', 'Intel QuickSync'),
-  ]
-
-  available = av.codec.hwaccel.hwdevices_available()
-  ret = []
-  for candidate in candidates:
-    if candidate[0] in available:
-      ret.append(candidate)
-  return ret
-
-# Set of hwaccels that we've already seen a failure for and shouldn't try every time we load a new
-# video.
-failed_hwaccels = set()
-
 class VideoProcessor(QtCore.QObject):
-  # frame data, frame time
-  frame_decoded = QtCore.Signal(QtMultimedia.QVideoFrame, float)
+  # frame data, frame time, generation of the request (passed through for the GUI), time it took to decode and process
+  # the frame in seconds (0 if it came from the cache). Unlike the time from request to delivery, this doesn't depend
+  # on whether the frame was processed ahead.
+  frame_decoded = QtCore.Signal(QtMultimedia.QVideoFrame, float, int, float)
 
   eof = QtCore.Signal()
 
   new_video_info = QtCore.Signal(VideoInfo)
 
+  # More accurate info for the current video (eg. exact number of frames once the keyframe index is built).
+  video_info_updated = QtCore.Signal(VideoInfo)
+
+  # Emitted from the index building thread, to hand the index over to the video processor thread.
+  _keyframe_index_built = QtCore.Signal(str, object)
+
   def __init__(self):
     super().__init__()
     self._path = None
     self._reader = None
+
+    # If we have a proxy for the current video (and are allowed to use it), we decode that instead. _decode_path is what
+    # the reader reads.
+    self._use_proxy = False
+    self._proxy = None
+    self._decode_path = None
     self._video_info = None
     self._last_frame = None
     self._carry = None
-
+    self._playing = False
+
+    # Index of the last frame shown. When that came from the processed frame cache, it was never decoded, and
+    # _last_frame is None until a request to reprocess it needs it.
+    self._last_index = None
+
+    # Normalisation carry from before _last_frame was processed. When we reprocess the same frame (eg. for a config
+    # change), we start from this again, so the temporal smoothing doesn't count the same frame multiple times.
+    self._last_frame_step1_carry = None
+
+    # During playback, frames are decoded ahead on a separate thread, so decoding overlaps with processing here and
+    # display in the GUI thread. While this exists, only the decode thread touches the reader.
+    self._decoded_frames = None
+
+    # Size to set on the reader before decoding the next frame.
+    self._pending_size = None
+
+    # Frame shapes (and other static kernel arguments) we have already started warming up the kernels for.
+    self._warmed_up = set()
+
+    # Decoded frames are keyed by ('decoded', frame index, (width, height)), and display-ready frames by ('processed',
+    # frame index, config key, do_processing, requested width, requested height, proxy scale). Display-ready frames
+    # are (uint8 numpy array, frame time, rotation), so they can be shown without decoding the frame again.
+    self._frame_cache = frame_cache.FrameCache(_FRAME_CACHE_BUDGET_BYTES)
+
+    # One more than can be in flight, for the frame we are writing.
+    self._video_frame_pool = np_qt_adapter.VideoFramePool(_MAX_QT_FRAMES_IN_FLIGHT + 1)
+
+    # Seeks are lazy. We only seek the reader when we actually need to decode a frame that's not in the cache.
+    # _next_index is the index of the next frame to show, and _reader_next_index is the index of the next frame the
+    # reader (or the decode thread) will produce. None means unknown.
+    self._next_index = None
+    self._reader_next_index = None
+
+    # Size we last asked the reader to decode at.
+    self._target_size = None
+
+    # Largest size worth decoding at (the native size of the proxy), or None if not limited.
+    self._max_decode_size = None
+
+    # In proxy mode, preview frames are decoded (and so normalised, stabilised etc) at most at this fraction of the
+    # native resolution. Export is not affected.
+    self._proxy_scale = 1.0
+
+    # During playback, we process frames ahead between requests, so requests can usually be served right away. The
+    # frames are only valid for the request parameters in _prefetch_key (configs, do_processing, width, height and
+    # proxy scale). While there are prefetched frames, the first one is the next frame to show, and _next_index is
+    # after the last one.
+    self._prefetched = collections.deque()
+    self._prefetched_bytes = 0
+    self._prefetch_key = None
+    self._prefetch_configs = None
+    self._prefetch_scheduled = False
+
+    # Frame times and keyframes of the current video. This is built in the background the first time we see a video.
+    self._keyframe_index = None
+    self._keyframe_index_built.connect(self._adopt_keyframe_index)
+
+  # With use_proxy, we decode the proxy of path instead if there is one. Loading the same path with a different
+  # use_proxy switches the reader, and keeps the position.
   @QtCore.Slot()
-  def request_load_video(self, path):
-    if self._path != path:
+  def request_load_video(self, path, use_proxy):
+    if self._path != path or self._use_proxy != use_proxy:
+      resume_time = None
+      if self._path == path and self._last_index is not None:
+        resume_time = self._index_time(self._last_index)
       self._path = path
+      self._use_proxy = use_proxy
+      self._stop_decoding()
 
       if self._reader:
         # If we already have a reader, we force it to be deallocated first. Otherwise
@@ -114,86 +190,353 @@ class VideoProcessor(QtCore.QObject):
         self._reader = None
         gc.collect()
 
-      decoder_name = 'Software'
-      for hwaccel, hwaccel_name in guess_hardware_decoders():
-        if hwaccel in failed_hwaccels:
-          continue
-        try:
-          self._reader = video_reader.VideoReader(filename=path, hwaccel=hwaccel)
-          decoder_name = hwaccel_name
-          break
-        except Exception as e:
-          failed_hwaccels.add(hwaccel)
-          print(e)
-          self._reader = None
-
-      if self._reader is None:
-        # Fallback to software decode.
-        self._reader = video_reader.VideoReader(filename=path)
-
-      # Some formats don't record number of frames, so we estimate using duration and frame rate instead
-      # (assuming constant frame rate).
-      num_frames = self._reader.num_frames()
-      if num_frames is None or num_frames == 0:
-        num_frames = round(self._reader.duration() / self._reader.frame_rate())
-
-      self._video_info = VideoInfo(
-        width=self._reader.width(),
-        height=self._reader.height(),
-        frame_rate=self._reader.frame_rate(),
-        duration=self._reader.duration(),
-        num_frames=num_frames,
-        decoder_name=decoder_name,
-      )
-
+      self._proxy = proxy_transcoder.load_cached(path) if use_proxy else None
+      if self._proxy is not None:
+        # We only need metadata from the source, so we use a software reader to avoid taking up a hardware decoder
+        # context.
+        self._video_info = decoding.get_video_info(video_reader.VideoReader(filename=path), 'Software')
+        self._decode_path = self._proxy.path
+        self._reader, decoder_name = decoding.open_video_reader(self._decode_path)
+        self._video_info.decoder_name = f'Proxy ({decoder_name})'
+      else:
+        self._decode_path = path
+        self._reader, decoder_name = decoding.open_video_reader(path)
+        self._video_info = decoding.get_video_info(self._reader, decoder_name)
+
+      # The index is for the file we actually decode, since that's what seeks are in.
+      self._keyframe_index = keyframe_index.load_cached(self._decode_path)
+      if self._keyframe_index is None:
+        threading.Thread(target=self._build_keyframe_index, args=(self._decode_path,), daemon=True).start()
+      elif self._keyframe_index.num_frames() > 0:
+        self._video_info.num_frames = self._keyframe_index.num_frames()
+
+      self._clear_prefetched(rewind=False)
       self._carry = None
+      self._last_frame = None
+      self._last_index = None
+      self._frame_cache.clear()
+      self._next_index = None if resume_time is None else self._frame_index(resume_time)
+      self._reader_next_index = 0
+      self._target_size = (self._reader.width(), self._reader.height())
+      # No point decoding a proxy at more than its own resolution.
+      self._max_decode_size = self._target_size if self._proxy is not None else None
+      # Start at the proxy resolution, so the first frame after loading isn't decoded at full size.
+      proxy_size = self._proxy_size()
+      if proxy_size is not None:
+        self._target_size = proxy_size
+        self._pending_size = proxy_size
 
       self.new_video_info.emit(self._video_info)
 
   @QtCore.Slot()
-  def request_one_frame(self, width, height, try_reuse_frame, do_processing, configs):
+  def request_one_frame(self, width, height, try_reuse_frame, do_processing, configs, min_frame_time, generation):
     try:
+      prefetch_key = (_config_key(configs), do_processing, width, height, self._proxy_scale)
+      if prefetch_key != self._prefetch_key or try_reuse_frame:
+        self._clear_prefetched()
+        self._prefetch_key = prefetch_key
+        self._prefetch_configs = configs
+
+      # During playback, frames before min_frame_time would be shown late, so we skip them. They are still decoded if
+      # that's cheaper than seeking (see _next_frame), but not processed.
+      if min_frame_time > 0.0 and not try_reuse_frame:
+        min_index = self._frame_index(min_frame_time)
+        while self._prefetched and self._prefetched[0].index < min_index:
+          self._prefetched_bytes -= self._prefetched.popleft().size_bytes()
+        if not self._prefetched and self._next_index is not None:
+          self._next_index = max(self._next_index, min_index)
+
+      def processed_key(index):
+        return ('processed', index, _config_key(configs), do_processing, width, height, self._proxy_scale)
+
+      display_frame = None
+      processing_time = 0.0
+      if self._prefetched and not try_reuse_frame:
+        prefetched = self._prefetched.popleft()
+        self._prefetched_bytes -= prefetched.size_bytes()
+        decoded = prefetched.decoded
+        display_frame = prefetched.display_frame
+        frame_time, rotation = decoded.frame_time, decoded.rotation
+        processing_time = prefetched.processing_time
+        self._last_frame = decoded
+        self._last_index = prefetched.index
+        self._last_frame_step1_carry = prefetched.step1_carry
+
       # We may end up processing multiple frames, because gyroflow delays by one frame to avoid waiting for
       # the GPU to CPU sync.
-      frame = None
-      while frame is None:
-        if self._last_frame is not None and try_reuse_frame:
-          frame = self._last_frame
+      while display_frame is None:
+        start_time = time.time()
+        if self._last_index is not None and try_reuse_frame:
+          if self._last_frame is None:
+            # The last frame came from the processed frame cache, so we have to decode it now.
+            self._next_index = self._last_index
+            self._last_frame = self._next_frame()
+            self._last_frame_step1_carry = self._carry.get('step1_carry') if self._carry is not None else None
+          decoded = self._last_frame
+          if self._carry is not None:
+            self._carry['step1_carry'] = self._last_frame_step1_carry
         else:
-          frame = next(self._reader)
-          self._last_frame = frame
+          # Scrubbing back over frames we have already shown doesn't need to seek or decode at all. Decoded frames
+          # are much larger than processed ones, so they are usually evicted from the cache first.
+          cached = self._frame_cache.get(processed_key(self._next_index)) if self._next_index is not None else None
+          if cached is not None:
+            display_frame, frame_time, rotation = cached
+            processing_time = 0.0
+            self._last_frame = None
+            self._last_index = self._next_index
+            self._next_index += 1
+            break
+          decoded = self._next_frame()
+          self._last_frame = decoded
+          self._last_index = self._frame_index(decoded.frame_time)
+          self._last_frame_step1_carry = self._carry.get('step1_carry') if self._carry is not None else None
+
+        cached = self._frame_cache.get(processed_key(self._last_index))
+        if cached is not None:
+          display_frame, frame_time, rotation = cached
+          processing_time = 0.0
+          break
 
-        if do_processing:
-          frame, self._carry = process.process_one_frame(frame, self._carry, configs, self._reader.filename())
+        display_frame = self._process_for_display(decoded, do_processing, configs)
+        processing_time += time.time() - start_time
+        if display_frame is not None:
+          frame_time, rotation = decoded.frame_time, decoded.rotation
+          self._frame_cache.put(processed_key(self._last_index), (display_frame, frame_time, rotation),
+                                display_frame.nbytes)
 
-      reader_frame, frame_time, rotation, max_val = frame.data, frame.frame_time, frame.rotation, frame.max_val
-      frame = convert_to_display(reader_frame, rotation=rotation, max_val=max_val)
+      # Frames are processed in their stored orientation, and the rotation is applied by Qt when displaying, unless
+      # processing had to rotate the pixels already (for side by side).
+      display_rotation = 0 if do_processing and process.rotates_pixels(configs) else rotation
 
       # Convert to QVideoFrame here because we are still in the video processor thread. This avoids blocking
       # the GUI thread while waiting for the GPU sync.
-      #qt_frame = np_qt_adapter.array_to_qvideo_frame(frame, self._video_frame_queues[self._next_video_frame_idx])
-      qt_frame = np_qt_adapter.array_to_qvideo_frame(frame, None)
+      qt_frame = self._video_frame_pool.array_to_qvideo_frame(display_frame, rotation=display_rotation)
 
-      self.frame_decoded.emit(qt_frame, frame_time)
+      self.frame_decoded.emit(qt_frame, frame_time, generation, processing_time)
 
       # Tell the reader what size we want for the next frame, so they can be pre-scaled. We have to do that
       # here because the frame may be rotated and we only see that here.
-      w, h = display_w_h(reader_frame.shape[1], reader_frame.shape[0], width, height, rotation)
+      frame_h, frame_w = display_frame.shape[:2]
+      if display_rotation != rotation and rotation in (-90, 90, -270, 270):
+        # Back to the stored orientation.
+        frame_w, frame_h = frame_h, frame_w
+      w, h = display_w_h(frame_w, frame_h, width, height, rotation)
       if rotation in (-90, 90, -270, 270):
         w, h = h, w
-      self._reader.set_width(w)
-      self._reader.set_height(h)
+      w, h = bucket_size(w, self._video_info.width, self._video_info.height)
+      # No point decoding at a higher resolution than the output if the preview is larger.
+      output_size = process.scaled_size(self._video_info.width, self._video_info.height, configs)
+      if do_processing and output_size is not None and w > output_size[0]:
+        w, h = output_size
+      proxy_size = self._proxy_size()
+      if proxy_size is not None and w > proxy_size[0]:
+        w, h = proxy_size
+      if self._max_decode_size is not None and w > self._max_decode_size[0]:
+        w, h = self._max_decode_size
+      if (w, h) != self._target_size:
+        self._target_size = (w, h)
+        self._pending_size = (w, h)
+
+      # Compile the kernels for the shape the next frames will have ahead of time, in the background.
+      if do_processing and self._last_frame is not None:
+        decoded = self._last_frame
+        next_shape = (h, w) + decoded.data.shape[2:]
+        warmup_key = (next_shape, decoded.data.dtype, decoded.rotation, decoded.max_val)
+        if warmup_key not in self._warmed_up:
+          self._warmed_up.add(warmup_key)
+          process.warmup_async(next_shape, decoded.data.dtype, decoded.rotation, decoded.max_val, configs)
+
+      if self._playing:
+        self._schedule_prefetch()
     except StopIteration:
+      self._stop_decoding()
       self.eof.emit()
 
+  # Returns the uint8 RGBX frame to display, or None if there's no output for this frame (Gyroflow can drop frames).
+  def _process_for_display(self, decoded, do_processing, configs) -> np.ndarray | None:
+    if do_processing and not process.uses_gyroflow(configs):
+      # Everything in one kernel.
+      display_frame, self._carry = process.process_one_frame_for_display(decoded, self._carry, configs)
+    else:
+      frame = decoded
+      if do_processing:
+        frame, self._carry = process.process_one_frame(decoded, self._carry, configs, self._path, rotate=False)
+        if frame is None:
+          return None
+      # The rotation is applied on display, unless processing already applied it (see process.rotates_pixels).
+      display_frame = process.convert_to_display(frame.data, rotation=0, max_val=frame.max_val, rgbx=True)
+    return np.asarray(display_frame)
+
+  # Prefetching goes through the event loop one frame at a time, so requests from the GUI are handled in between.
+  def _schedule_prefetch(self):
+    if not self._prefetch_scheduled:
+      self._prefetch_scheduled = True
+      QtCore.QTimer.singleShot(0, self._prefetch_next)
+
+  def _prefetch_next(self):
+    self._prefetch_scheduled = False
+    if (not self._playing or self._reader is None or self._prefetch_key is None or
+        len(self._prefetched) >= _PREFETCH_FRAMES or self._prefetched_bytes >= _PREFETCH_BUDGET_BYTES):
+      return
+    do_processing = self._prefetch_key[1]
+    step1_carry = self._carry.get('step1_carry') if self._carry is not None else None
+    start_time = time.time()
+    try:
+      decoded = self._next_frame()
+    except StopIteration:
+      # The next request will find out about the end of the video.
+      return
+    display_frame = self._process_for_display(decoded, do_processing, self._prefetch_configs)
+    if display_frame is not None:
+      prefetched = _PrefetchedFrame(index=self._frame_index(decoded.frame_time), decoded=decoded,
+                                    display_frame=display_frame, step1_carry=step1_carry,
+                                    processing_time=time.time() - start_time)
+      self._prefetched.append(prefetched)
+      self._prefetched_bytes += prefetched.size_bytes()
+    self._schedule_prefetch()
+
+  # Drops prefetched frames. With rewind, the next frame to show and the normalisation state go back to the first of
+  # them, as if they were never processed.
+  def _clear_prefetched(self, rewind: bool = True):
+    if self._prefetched and rewind:
+      self._next_index = self._prefetched[0].index
+      if self._carry is not None:
+        self._carry['step1_carry'] = self._prefetched[0].step1_carry
+    self._prefetched.clear()
+    self._prefetched_bytes = 0
+
   @QtCore.Slot()
   def request_seek_to(self, frame_time):
     if self._reader:
-      self._reader.seek(frame_time)
+      self._clear_prefetched(rewind=False)
+      # We don't actually seek here, in case the frame is in the cache. See _next_frame().
+      self._next_index = self._frame_index(frame_time)
+      # Normalisation statistics from somewhere else in the video shouldn't be smoothed into the new position.
+      if self._carry is not None:
+        self._carry['step1_carry'] = None
+
+  def _frame_index(self, frame_time: float) -> int:
+    if self._keyframe_index is not None:
+      return self._keyframe_index.frame_index(frame_time)
+    return round(frame_time * self._video_info.frame_rate)
+
+  def _index_time(self, index: int) -> float:
+    if self._keyframe_index is not None:
+      return self._keyframe_index.frame_time(index)
+    return index / self._video_info.frame_rate
+
+  # Runs on a background thread.
+  def _build_keyframe_index(self, path):
+    try:
+      index = keyframe_index.load_or_build(path)
+    except Exception as e:
+      print(f'Failed to build keyframe index for {path}: {e}')
+      return
+    self._keyframe_index_built.emit(path, index)
+
+  @QtCore.Slot()
+  def _adopt_keyframe_index(self, path, index):
+    if path != self._decode_path or index.num_frames() == 0:
+      return
+    self._keyframe_index = index
+    # Frame indices so far were estimated from the frame rate, so anything keyed by them is stale.
+    self._frame_cache.clear()
+    self._last_index = self._frame_index(self._last_frame.frame_time) if self._last_frame is not None else None
+    self._reader_next_index = None
+    self._video_info = dataclasses.replace(self._video_info, num_frames=index.num_frames())
+    self.video_info_updated.emit(self._video_info)
+
+  # Returns the next decoded frame, from the cache if possible, seeking the reader first if necessary.
+  def _next_frame(self):
+    index = self._next_index
+    if index is not None:
+      decoded = self._frame_cache.get(('decoded', index, self._target_size))
+      if decoded is not None:
+        self._next_index = index + 1
+        return decoded
+      if self._keyframe_index is not None:
+        decode_forward = (self._reader_next_index is not None and
+                          self._keyframe_index.same_gop(self._reader_next_index, index))
+      else:
+        decode_forward = (self._reader_next_index is not None and
+                          0 < index - self._reader_next_index <=
+                          self._video_info.frame_rate * _MAX_DECODE_FORWARD_WITHOUT_INDEX)
+      if index != self._reader_next_index and decode_forward:
+        # Seeking would (probably) decode from the same keyframe anyways, so we just decode forward (and cache the
+        # frames).
+        while self._reader_next_index < index:
+          skipped = self._next_decoded_frame()
+          skipped_index = self._frame_index(skipped.frame_time)
+          self._frame_cache.put(('decoded', skipped_index, (skipped.data.shape[1], skipped.data.shape[0])),
+                                skipped, skipped.data.nbytes)
+          self._reader_next_index = skipped_index + 1
+      if index != self._reader_next_index:
+        self._stop_decoding()
+        # Seek to the exact frame time if we know it.
+        self._reader.seek(self._index_time(index))
+
+    decoded = self._next_decoded_frame()
+    decoded_index = self._frame_index(decoded.frame_time)
+    decoded_size = (decoded.data.shape[1], decoded.data.shape[0])
+    self._frame_cache.put(('decoded', decoded_index, decoded_size), decoded, decoded.data.nbytes)
+    self._next_index = decoded_index + 1
+    self._reader_next_index = decoded_index + 1
+    return decoded
+
+  @QtCore.Slot()
+  def set_playing(self, playing):
+    self._playing = playing
+    if not playing:
+      self._clear_prefetched()
+
+  @QtCore.Slot()
+  def set_proxy_scale(self, proxy_scale):
+    self._proxy_scale = proxy_scale
+
+  # Decode size (in stored orientation) for the current proxy scale, or None if not using a proxy.
+  def _proxy_size(self) -> tuple[int, int] | None:
+    if self._proxy_scale >= 1.0 or self._video_info is None:
+      return None
+    return (max(2, round(self._video_info.width * self._proxy_scale / 2) * 2),
+            max(2, round(self._video_info.height * self._proxy_scale / 2) * 2))
+
+  # Runs on the decode thread during playback, or on this thread otherwise.
+  def _decode_one_frame(self):
+    if self._pending_size is not None:
+      w, h = self._pending_size
+      self._pending_size = None
+      self._reader.set_width(w)
+      self._reader.set_height(h)
+    frame = next(self._reader)
+    if self._proxy is not None:
+      frame = dataclasses.replace(frame, rotation=self._proxy.rotation)
+    return frame
+
+  def _next_decoded_frame(self):
+    # We only decode ahead while playing. Otherwise (eg. when scrubbing) most of the frames decoded ahead would be
+    # thrown away on the next seek.
+    if self._decoded_frames is None and self._playing:
+      self._decoded_frames = pipeline.Pipeline(source=self._decode_one_frame, queue_size=_DECODE_AHEAD)
+    if self._decoded_frames is not None:
+      return next(self._decoded_frames)
+    return self._decode_one_frame()
+
+  def _stop_decoding(self):
+    if self._decoded_frames is not None:
+      self._decoded_frames.close()
+      self._decoded_frames = None
 
   @QtCore.Slot()
   def unload_video(self):
+    self._stop_decoding()
     self._path = None
     self._reader = None
+    self._proxy = None
+    self._decode_path = None
     self._video_info = None
     self._carry = None
+    self._last_frame = None
+    self._last_index = None
+    self._clear_prefetched(rewind=False)
+    self._frame_cache.clear()
+    self._video_frame_pool.clear()